@@ -1,9 +1,16 @@
+import os
 import sqlite3
+import threading
 from config import DB_PATH
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    cur = conn.cursor()
+# bump when the DDL below changes; stored in PRAGMA user_version
+SCHEMA_VERSION = 1
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = set()  # absolute db paths already checked in this process
+
+def _create_schema(cur):
     # links: each generated link + derived deposit address + encrypted privkey (if created here)
     cur.execute("""
     CREATE TABLE IF NOT EXISTS links (
@@ -37,9 +44,59 @@ def init_db():
         created_at TEXT
     )
     """)
-    conn.commit()
+
+def ensure_schema(conn, db_path=DB_PATH):
+    key = os.path.abspath(db_path)
+    if key in _schema_ready:
+        return
+    with _schema_lock:
+        if key in _schema_ready:
+            return
+        cur = conn.cursor()
+        version = cur.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"{db_path} has schema version {version}, this code supports up to {SCHEMA_VERSION}")
+        if version < SCHEMA_VERSION:
+            _create_schema(cur)
+            cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.commit()
+        _schema_ready.add(key)
+
+def _open(check_same_thread=True):
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    ensure_schema(conn)
     return conn
 
-# for quick import
-conn = init_db()
-cur = conn.cursor()
+def get_conn():
+    # one connection per thread, opened on first use
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _open()
+        _local.conn = conn
+    return conn
+
+_shared_conn = None
+_shared_cur = None
+_shared_lock = threading.Lock()
+
+def init_db():
+    # the shared connection older callers pass between threads, as before; opened once on first use
+    global _shared_conn, _shared_cur
+    if _shared_conn is None:
+        with _shared_lock:
+            if _shared_conn is None:
+                conn = _open(check_same_thread=False)
+                _shared_cur = conn.cursor()
+                _shared_conn = conn
+    return _shared_conn
+
+# for quick import: `from db_init import conn, cur` still works, but connects lazily
+def __getattr__(name):
+    if name == 'conn':
+        return init_db()
+    if name == 'cur':
+        init_db()
+        return _shared_cur
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,24 +1,41 @@
-import base64, os
+import base64, os, threading
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives import hashes
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
 from config import MASTER_SECRET
 
 # NOTE: in production use KMS or securely store salt separately
 SALT = b"app_static_salt_v1_please_change"
 
-def derive_key(master_secret: str) -> bytes:
+# derived Fernet instances, keyed by (master_secret, salt) - PBKDF2 runs once per pair per process
+_fernet_cache = {}
+_fernet_lock = threading.Lock()
+
+def derive_key(master_secret: str, salt: bytes = SALT) -> bytes:
     kdf = PBKDF2HMAC(
         algorithm=hashes.SHA256(),
         length=32,
-        salt=SALT,
+        salt=salt,
         iterations=390000,
     )
     return base64.urlsafe_b64encode(kdf.derive(master_secret.encode()))
 
-def get_fernet():
-    key = derive_key(MASTER_SECRET)
-    return Fernet(key)
+def get_fernet(master_secret: str = None, salt: bytes = None):
+    master_secret = MASTER_SECRET if master_secret is None else master_secret
+    salt = SALT if salt is None else salt
+    cache_key = (master_secret, salt)
+    f = _fernet_cache.get(cache_key)
+    if f is None:
+        with _fernet_lock:
+            f = _fernet_cache.get(cache_key)
+            if f is None:
+                f = Fernet(derive_key(master_secret, salt))
+                _fernet_cache[cache_key] = f
+    return f
+
+def clear_key_cache():
+    with _fernet_lock:
+        _fernet_cache.clear()
 
 def encrypt_privkey(privkey_hex: str) -> str:
     f = get_fernet()
@@ -28,3 +45,25 @@ def encrypt_privkey(privkey_hex: str) -> str:
 def decrypt_privkey(token_str: str) -> str:
     f = get_fernet()
     return f.decrypt(token_str.encode()).decode()
+
+def encrypt_many(privkeys):
+    f = get_fernet()
+    return [f.encrypt(p.encode()).decode() for p in privkeys]
+
+def decrypt_many(tokens, errors='raise'):
+    # errors='raise' propagates the first failure, errors='keep' returns the exception in its slot
+    f = get_fernet()
+    out = []
+    for t in tokens:
+        try:
+            out.append(f.decrypt(t.encode()).decode())
+        except Exception as e:
+            if errors != 'keep':
+                raise
+            out.append(e)
+    return out
+
+def rotate_tokens(tokens, old_master_secret: str, old_salt: bytes = None):
+    # re-encrypt tokens made under an old secret with the current MASTER_SECRET/SALT
+    mf = MultiFernet([get_fernet(), get_fernet(old_master_secret, old_salt)])
+    return [mf.rotate(t.encode()).decode() for t in tokens]
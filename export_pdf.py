@@ -1,16 +1,36 @@
-import os, io, tempfile
+import os, io
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.lib.pdfencrypt import StandardEncryption
 from reportlab.pdfgen import canvas
-from PyPDF2 import PdfReader, PdfWriter
 import qrcode
 import sqlite3
 from encryption_utils import decrypt_privkey
 from config import DB_PATH
 
-def generate_pdf(records, out_path):
-    packet = io.BytesIO()
-    c = canvas.Canvas(packet, pagesize=A4)
+# rows fetched per page from links, and decrypt workers per export
+EXPORT_PAGE_SIZE = 500
+EXPORT_WORKERS = 4
+# PNG-encoded QR codes kept per address, so re-exports skip QR generation
+QR_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_png(address):
+    buf = io.BytesIO()
+    qrcode.make(address).save(buf, format='PNG')
+    return buf.getvalue()
+
+def qr_image(address):
+    return ImageReader(io.BytesIO(qr_png(address)))
+
+def generate_pdf(records, out_path, password=None):
+    # records may be any iterable; pages are drawn as rows arrive.
+    # with a password the PDF is encrypted while it is written, so no plaintext copy hits disk
+    encrypt = StandardEncryption(password, ownerPassword=password, strength=128) if password else None
+    c = canvas.Canvas(out_path, pagesize=A4, encrypt=encrypt)
     width, height = A4
     margin_x = 40
     y_start = height - 80
@@ -23,58 +43,57 @@ def generate_pdf(records, out_path):
         c.drawString(margin_x, y_start - 20, f"Private Key (hex): {r['privhex']}")
         c.drawString(margin_x, y_start - 40, f"Order ID: {r['order_id']}")
         c.drawString(margin_x, y_start - 60, f"Created: {r['created_at']}")
-        # add QR
-        qr = qrcode.make(r['address'])
-        qr_path = tempfile.mktemp(suffix='.png')
-        qr.save(qr_path)
-        # Draw QR on right
-        c.drawImage(qr_path, width - 160, y_start - 80, 120, 120)
-        try:
-            os.remove(qr_path)
-        except:
-            pass
+        # Draw QR on right, rendered in memory
+        c.drawImage(qr_image(r['address']), width - 160, y_start - 80, 120, 120)
         c.showPage()
     c.save()
-    packet.seek(0)
-    with open(out_path, 'wb') as f:
-        f.write(packet.read())
 
-def encrypt_pdf(input_path, output_path, password):
-    reader = PdfReader(input_path)
-    writer = PdfWriter()
-    for p in reader.pages:
-        writer.add_page(p)
-    # password protection (owner/user same password)
-    writer.encrypt(user_pwd=password, owner_pwd=None)
-    with open(output_path, 'wb') as f:
-        writer.write(f)
+def _decrypt_row(row):
+    _, address, priv_enc, order_id, created_at = row
+    try:
+        privhex = decrypt_privkey(priv_enc)
+    except Exception as e:
+        privhex = f"DECRYPT_ERROR: {str(e)}"
+    return {
+        'address': address,
+        'privhex': privhex,
+        'order_id': order_id,
+        'created_at': created_at,
+    }
+
+def iter_key_records(conn, page_size=EXPORT_PAGE_SIZE, workers=EXPORT_WORKERS):
+    # keyset-paginate links by rowid and decrypt each page in a worker pool,
+    # so only one page of rows is held in memory at a time
+    cur = conn.cursor()
+    last_rowid = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            cur.execute("""SELECT rowid, address, priv_enc, order_id, created_at FROM links
+                           WHERE priv_enc IS NOT NULL AND rowid > ?
+                           ORDER BY rowid LIMIT ?""", (last_rowid, page_size))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            last_rowid = rows[-1][0]
+            for record in pool.map(_decrypt_row, rows):
+                yield record
 
 def export_all_keys_to_pdf(admin_id, output_filename_base, pdf_password):
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
-    cur.execute("SELECT address, priv_enc, order_id, created_at FROM links WHERE priv_enc IS NOT NULL")
-    rows = cur.fetchall()
-    records = []
-    for address, priv_enc, order_id, created_at in rows:
-        try:
-            privhex = decrypt_privkey(priv_enc)
-        except Exception as e:
-            privhex = f"DECRYPT_ERROR: {str(e)}"
-        records.append({
-            'address': address,
-            'privhex': privhex,
-            'order_id': order_id,
-            'created_at': created_at,
-        })
 
-    tmp_pdf = output_filename_base + '.tmp.pdf'
     final_pdf = output_filename_base + '.pdf'
-    generate_pdf(records, tmp_pdf)
-    encrypt_pdf(tmp_pdf, final_pdf, pdf_password)
+    part_pdf = final_pdf + '.part'
     try:
-        os.remove(tmp_pdf)
+        generate_pdf(iter_key_records(conn), part_pdf, pdf_password)
+        os.replace(part_pdf, final_pdf)
     except:
-        pass
+        try:
+            os.remove(part_pdf)
+        except:
+            pass
+        conn.close()
+        raise
 
     # log the export
     cur.execute("INSERT INTO exports (admin_id, file_path, created_at) VALUES (?, ?, ?)",
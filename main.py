@@ -5,6 +5,7 @@ Developer: @professor_cry
 Fixed: Export file upload, Username underscore issue
 """
 
+import asyncio
 import json
 import logging
 import os
@@ -457,38 +458,29 @@ async def track_admins_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Track error: {e}")
         await update.message.reply_text(f"❌ Error: {str(e)[:200]}", parse_mode=ParseMode.MARKDOWN)
 
-async def export_data_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Export data command - COMPLETE BAN HISTORY WITH USER IDs - FIXED UPLOAD"""
-    if not await is_admin(update, context):
-        await update.message.reply_text("❌ Only admins can export.", parse_mode=ParseMode.MARKDOWN)
-        return
-    
-    chat_id = update.effective_chat.id
-    
-    await update.message.reply_text("📤 Preparing complete ban history export...", parse_mode=ParseMode.MARKDOWN)
+# ============ EXPORTS ============
+# at most this many exports build at once; a second /export in a chat is refused while one is running
+MAX_CONCURRENT_EXPORTS = 2
+_export_slots = None
+_running_exports: Dict[int, asyncio.Task] = {}
+
+def write_ban_history(filepath: str, chat_id: int, chat_title: str, exported_by: str, exported_by_id: int) -> int:
+    """Stream the ban history export to filepath, returns the number of ban records"""
+    config = SimpleDB.load_config(chat_id)
+    users = SimpleDB.load_users(chat_id)
+    bans = SimpleDB.load_bans(chat_id)
+    ban_list = bans.get('list', [])
     
-    try:
-        # Load data
-        config = SimpleDB.load_config(chat_id)
-        users = SimpleDB.load_users(chat_id)
-        bans = SimpleDB.load_bans(chat_id)
-        
-        # Create comprehensive export
-        export_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-        group_name = ''.join(c for c in update.effective_chat.title if c.isalnum() or c in (' ', '-', '_')).rstrip()
-        filename = f"ban_history_{chat_id}_{export_time}.txt"
-        filepath = os.path.join(DATA_DIR, filename)
-        
-        # Prepare content
-        content = f"""📋 COMPLETE BAN HISTORY - {BOT_NAME}
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write(f"""📋 COMPLETE BAN HISTORY - {BOT_NAME}
 ================================================
 
 GROUP INFORMATION:
 ------------------
-Group Name: {update.effective_chat.title}
+Group Name: {chat_title}
 Group ID: {chat_id}
 Export Date: {datetime.now().isoformat()}
-Exported By: {update.effective_user.full_name} (ID: {update.effective_user.id})
+Exported By: {exported_by} (ID: {exported_by_id})
 
 CONFIGURATION:
 --------------
@@ -512,13 +504,11 @@ Manual Bans: {bans.get('manual', 0)}
 
 COMPLETE BAN LIST (ALL TIME):
 =============================
-"""
+""")
         
         # Add ALL banned users with their IDs
-        ban_list = bans.get('list', [])
-        
         if not ban_list:
-            content += "\nNo ban records found.\n"
+            f.write("\nNo ban records found.\n")
         else:
             for i, ban in enumerate(ban_list, 1):
                 user_id = ban.get('user_id', 'N/A')
@@ -538,16 +528,16 @@ COMPLETE BAN LIST (ALL TIME):
                 # Format username for file
                 formatted_username = format_username_for_file(username)
                 
-                content += f"\n{i}. USER INFORMATION:\n"
-                content += f"   Name: {user_name}\n"
-                content += f"   ID: {user_id}\n"
-                content += f"   Username: @{formatted_username}\n"
-                content += f"   Ban Time: {formatted_time}\n"
-                content += f"   Ban Type: {ban_type}\n"
-                content += f"   Reason: {reason}\n"
-                content += "   " + "-"*40
+                f.write(f"\n{i}. USER INFORMATION:\n"
+                        f"   Name: {user_name}\n"
+                        f"   ID: {user_id}\n"
+                        f"   Username: @{formatted_username}\n"
+                        f"   Ban Time: {formatted_time}\n"
+                        f"   Ban Type: {ban_type}\n"
+                        f"   Reason: {reason}\n"
+                        "   " + "-"*40)
         
-        content += f"""
+        f.write(f"""
 
 SUMMARY:
 --------
@@ -557,46 +547,77 @@ File Format: UTF-8
 
 ================================================
 END OF EXPORT
-"""
-        
-        # Save file
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(content)
-        
-        # Send file to user
-        try:
-            with open(filepath, 'rb') as f:
-                await update.message.reply_document(
-                    document=f,
-                    filename=filename,
-                    caption=f"📁 *Ban History Export*\n\n📊 *Total Records:* {len(ban_list)}\n📅 *Exported:* {datetime.now().strftime('%Y-%m-%d %H:%M')}\n💾 *File:* `{filename}`",
-                    parse_mode=ParseMode.MARKDOWN
-                )
-            logger.info(f"Exported file sent: {filename}")
+""")
+    return len(ban_list)
+
+async def run_export(update: Update, chat_id: int):
+    """Build the export off the event loop and upload it"""
+    global _export_slots
+    if _export_slots is None:
+        _export_slots = asyncio.Semaphore(MAX_CONCURRENT_EXPORTS)
+    
+    try:
+        async with _export_slots:
+            export_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"ban_history_{chat_id}_{export_time}.txt"
+            filepath = os.path.join(DATA_DIR, filename)
             
-        except Exception as e:
-            logger.error(f"File upload error: {e}")
-            # If file upload fails, send info message
-            file_size = os.path.getsize(filepath)
-            size_text = f"{file_size // 1024} KB" if file_size > 1024 else f"{file_size} bytes"
+            record_count = await asyncio.to_thread(
+                write_ban_history, filepath, chat_id, update.effective_chat.title,
+                update.effective_user.full_name, update.effective_user.id
+            )
             
-            text = f"""
+            # Send file to user
+            try:
+                with open(filepath, 'rb') as f:
+                    await update.message.reply_document(
+                        document=f,
+                        filename=filename,
+                        caption=f"📁 *Ban History Export*\n\n📊 *Total Records:* {record_count}\n📅 *Exported:* {datetime.now().strftime('%Y-%m-%d %H:%M')}\n💾 *File:* `{filename}`",
+                        parse_mode=ParseMode.MARKDOWN
+                    )
+                logger.info(f"Exported file sent: {filename}")
+                
+            except Exception as e:
+                logger.error(f"File upload error: {e}")
+                # If file upload fails, send info message
+                file_size = os.path.getsize(filepath)
+                size_text = f"{file_size // 1024} KB" if file_size > 1024 else f"{file_size} bytes"
+                
+                text = f"""
 ✅ *Export Complete - Download Manually*
 
 📄 *File Details:*
 ├ File: `{filename}`
 ├ Size: {size_text}
 ├ Location: `{filepath}`
-├ Records: {len(ban_list)}
+├ Records: {record_count}
 └ Export Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 
 ⚠️ *Note:* File saved locally. Upload to Telegram failed.
 """
-            await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+                await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
         
     except Exception as e:
         logger.error(f"Export error: {e}")
         await update.message.reply_text(f"❌ Export failed: {str(e)[:200]}", parse_mode=ParseMode.MARKDOWN)
+    finally:
+        _running_exports.pop(chat_id, None)
+
+async def export_data_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Export data command - COMPLETE BAN HISTORY WITH USER IDs - runs in the background"""
+    if not await is_admin(update, context):
+        await update.message.reply_text("❌ Only admins can export.", parse_mode=ParseMode.MARKDOWN)
+        return
+    
+    chat_id = update.effective_chat.id
+    
+    if chat_id in _running_exports:
+        await update.message.reply_text("⏳ An export for this group is already in progress.", parse_mode=ParseMode.MARKDOWN)
+        return
+    
+    await update.message.reply_text("📤 Preparing complete ban history export...", parse_mode=ParseMode.MARKDOWN)
+    _running_exports[chat_id] = asyncio.create_task(run_export(update, chat_id))
 
 async def ban_logs_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Ban logs command with user IDs - shows last 10 bans"""
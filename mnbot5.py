@@ -7,13 +7,23 @@ import re
 import threading
 import json
 import traceback
+import codecs
+import gzip
+import tempfile
+import itertools
+import weakref
+import requests
 import phonenumbers
 import pycountry
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import datetime, timedelta
 from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor
 from queue import Queue
+from collections import OrderedDict, deque
 import telebot
-from telebot import types
+from telebot import apihelper, types
 
 # Configure logging
 logging.basicConfig(
@@ -40,10 +50,47 @@ pending_withdrawals = {}
 message_cache = {}
 processing_lock = Lock()
 
+# EXPLAIN QUERY PLAN detail for a scan that walks an index rather than the table
+INDEX_SCAN_PATTERN = re.compile(r'\bUSING (?:COVERING )?INDEX\b')
+
+class _ConnHolder:
+    """Owns one thread's connection; see Database.conn."""
+    __slots__ = ('conn', 'finalizer', '__weakref__')
+    
+    def __init__(self, conn):
+        self.conn = conn
+        self.finalizer = None
+
 # Database setup with connection pooling
 class Database:
+    """SQLite access with one connection per thread (WAL mode).
+    
+    Readers run concurrently on their own thread's connection; every write
+    goes through a single writer lock so SQLite never sees two writers from
+    this process. Time spent waiting for the writer lock is recorded and
+    available from lock_wait_stats().
+    """
     _instance = None
     _lock = threading.RLock()
+    DB_FILE = 'bot_database.db'
+    # stored in PRAGMA user_version; each step in migrate_tables() runs once
+    SCHEMA_VERSION = 6
+    
+    # (query, sample params) for lookups on hot paths; none may fall back to a full table scan
+    HOT_QUERIES = [
+        ("SELECT user_id FROM number_assignments WHERE number = ? AND is_active = 1", ('+10000000000',)),
+        ("SELECT COUNT(*) as count FROM number_assignments WHERE user_id = ? AND is_active = 1", (1,)),
+        ('''SELECT number, country, country_flag FROM numbers
+            WHERE country_code = ? AND is_used = 0
+            AND NOT EXISTS (SELECT 1 FROM number_assignments na
+                            WHERE na.number = numbers.number AND na.is_active = 1)
+            LIMIT ?''', ('US', 1)),
+        ('''SELECT * FROM otp_messages WHERE processed = 0 AND forwarded_to = 0
+            AND (queued_at IS NULL OR queued_at < ?) ORDER BY timestamp ASC LIMIT ?''', ('2000-01-01 00:00:00', 100)),
+        ("SELECT * FROM otp_messages WHERE number = ? AND processed = 0 ORDER BY timestamp DESC", ('+10000000000',)),
+        ("DELETE FROM otp_messages WHERE timestamp < ? AND processed = 1", ('2000-01-01 00:00:00',)),
+        ("SELECT messages_received, revenue_earned FROM user_stats WHERE user_id = ? AND date = ?", (1, '2000-01-01')),
+    ]
     
     def __new__(cls):
         if cls._instance is None:
@@ -53,11 +100,116 @@ class Database:
     
     def init_database(self):
         with self._lock:
-            self.conn = sqlite3.connect('bot_database.db', check_same_thread=False, timeout=30)
-            self.conn.row_factory = sqlite3.Row
+            self._local = threading.local()
+            self._pool = []
+            self._pool_lock = Lock()
+            self._write_lock = threading.RLock()
+            self._stats_lock = Lock()
+            self._lock_waits = 0
+            self._lock_wait_total = 0.0
+            self._lock_wait_max = 0.0
+            self._commits = 0
             self.create_tables()
             self.migrate_tables()
     
+    def _connect(self):
+        conn = sqlite3.connect(self.DB_FILE, check_same_thread=False, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        with self._pool_lock:
+            self._pool.append(conn)
+        return conn
+    
+    def _release(self, conn):
+        with self._pool_lock:
+            if conn in self._pool:
+                self._pool.remove(conn)
+        try:
+            conn.close()
+        except Exception:
+            pass
+    
+    @property
+    def conn(self):
+        """The calling thread's connection, opened on first use and closed when the thread exits."""
+        holder = getattr(self._local, 'holder', None)
+        if holder is None:
+            holder = _ConnHolder(self._connect())
+            # the thread-local dies with its thread, taking the holder with it
+            holder.finalizer = weakref.finalize(holder, self._release, holder.conn)
+            self._local.holder = holder
+        return holder.conn
+    
+    def _reconnect(self):
+        holder = getattr(self._local, 'holder', None)
+        self._local.holder = None
+        if holder is not None:
+            holder.finalizer()
+        return self.conn
+    
+    @contextmanager
+    def writer(self):
+        """Hold the single writer lock, recording how long we waited for it."""
+        start = time.perf_counter()
+        self._write_lock.acquire()
+        waited = time.perf_counter() - start
+        with self._stats_lock:
+            self._lock_waits += 1
+            self._lock_wait_total += waited
+            if waited > self._lock_wait_max:
+                self._lock_wait_max = waited
+        try:
+            yield
+        finally:
+            self._write_lock.release()
+    
+    def lock_wait_stats(self):
+        with self._stats_lock:
+            count = self._lock_waits
+            total = self._lock_wait_total
+            return {
+                'acquisitions': count,
+                'total_wait': total,
+                'avg_wait': total / count if count else 0.0,
+                'max_wait': self._lock_wait_max,
+                'connections': len(self._pool),
+                'commits': self._commits,
+            }
+    
+    def _commit(self):
+        self.conn.commit()
+        with self._stats_lock:
+            self._commits += 1
+    
+    def in_transaction(self):
+        return getattr(self._local, 'tx_depth', 0) > 0
+    
+    @contextmanager
+    def transaction(self):
+        """Run several writes as one unit with a single commit.
+        
+        Holds the writer lock and an IMMEDIATE transaction for the whole block,
+        so reads inside it see a stable view. Nested calls join the outer
+        transaction; an exception rolls everything back.
+        """
+        with self.writer():
+            depth = getattr(self._local, 'tx_depth', 0)
+            if depth == 0:
+                self.conn.execute("BEGIN IMMEDIATE")
+            self._local.tx_depth = depth + 1
+            try:
+                yield self
+            except BaseException:
+                self._local.tx_depth = depth
+                if depth == 0:
+                    self.conn.rollback()
+                raise
+            self._local.tx_depth = depth
+            if depth == 0:
+                self._commit()
+    
     def create_tables(self):
         c = self.conn.cursor()
         
@@ -205,7 +357,7 @@ class Database:
     
     def migrate_tables(self):
         """Migrate database tables to add new columns if needed"""
-        with self._lock:
+        with self.writer():
             try:
                 c = self.conn.cursor()
                 
@@ -255,32 +407,167 @@ class Database:
                     logger.info("Created reset_history table")
                 
                 self.conn.commit()
+                
+                version = c.execute("PRAGMA user_version").fetchone()[0]
+                if version < 1:
+                    self._migrate_v1(c)
+                    logger.info("Applied schema migration v1 (indexes, unique user_stats)")
+                if version < 2:
+                    self._migrate_v2(c)
+                    logger.info("Applied schema migration v2 (balance_ledger)")
+                if version < 3:
+                    c.execute("CREATE INDEX IF NOT EXISTS idx_numbers_country_number ON numbers (country, number)")
+                    logger.info("Applied schema migration v3 (numbers report index)")
+                if version < 4:
+                    c.execute('''CREATE TABLE IF NOT EXISTS export_jobs
+                                (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                 kind TEXT,
+                                 chat_id INTEGER,
+                                 status TEXT DEFAULT 'queued',
+                                 rows INTEGER DEFAULT 0,
+                                 file_name TEXT,
+                                 error TEXT,
+                                 created_at TEXT,
+                                 finished_at TEXT)''')
+                    logger.info("Applied schema migration v4 (export_jobs)")
+                if version < 5:
+                    c.execute("PRAGMA table_info(users)")
+                    if 'blocked_bot' not in [col[1] for col in c.fetchall()]:
+                        c.execute("ALTER TABLE users ADD COLUMN blocked_bot INTEGER DEFAULT 0")
+                    c.execute('''CREATE TABLE IF NOT EXISTS broadcasts
+                                (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                 admin_chat_id INTEGER,
+                                 progress_message_id INTEGER,
+                                 kind TEXT,
+                                 content TEXT,
+                                 caption TEXT,
+                                 status TEXT DEFAULT 'running',
+                                 last_user_id INTEGER DEFAULT 0,
+                                 total INTEGER DEFAULT 0,
+                                 sent INTEGER DEFAULT 0,
+                                 failed INTEGER DEFAULT 0,
+                                 blocked INTEGER DEFAULT 0,
+                                 created_at TEXT,
+                                 finished_at TEXT)''')
+                    logger.info("Applied schema migration v5 (broadcasts, users.blocked_bot)")
+                if version < 6:
+                    c.execute("PRAGMA table_info(otp_messages)")
+                    if 'queued_at' not in [col[1] for col in c.fetchall()]:
+                        c.execute("ALTER TABLE otp_messages ADD COLUMN queued_at TEXT")
+                    logger.info("Applied schema migration v6 (otp_messages.queued_at)")
+                
+                c.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+                self.conn.commit()
             except Exception as e:
+                self.conn.rollback()
                 logger.error(f"Error migrating tables: {e}")
     
+    def _migrate_v1(self, c):
+        """Indexes for the hot lookups and a UNIQUE (user_id, date) key on user_stats."""
+        # Fold duplicate user_stats rows (INSERT OR IGNORE never ignored anything) into the oldest one
+        c.execute('''UPDATE user_stats SET
+                        numbers_taken = (SELECT SUM(s.numbers_taken) FROM user_stats s
+                                         WHERE s.user_id = user_stats.user_id AND s.date = user_stats.date),
+                        messages_received = (SELECT SUM(s.messages_received) FROM user_stats s
+                                             WHERE s.user_id = user_stats.user_id AND s.date = user_stats.date),
+                        revenue_earned = (SELECT SUM(s.revenue_earned) FROM user_stats s
+                                          WHERE s.user_id = user_stats.user_id AND s.date = user_stats.date)
+                     WHERE id IN (SELECT MIN(id) FROM user_stats GROUP BY user_id, date HAVING COUNT(*) > 1)''')
+        c.execute('''DELETE FROM user_stats
+                     WHERE id NOT IN (SELECT MIN(id) FROM user_stats GROUP BY user_id, date)''')
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_user_stats_user_date ON user_stats (user_id, date)")
+        
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_assignments_number_active
+                     ON number_assignments (number, is_active, user_id)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_assignments_user_active
+                     ON number_assignments (user_id, is_active)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_numbers_country_used
+                     ON numbers (country_code, is_used)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_otp_processed_timestamp
+                     ON otp_messages (processed, timestamp)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_otp_number
+                     ON otp_messages (number, processed)''')
+    
+    def _migrate_v2(self, c):
+        """Append-only balance_ledger; every balance change is one row, keyed by ref when idempotent."""
+        c.execute('''CREATE TABLE IF NOT EXISTS balance_ledger
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     user_id INTEGER,
+                     amount REAL,
+                     reason TEXT,
+                     ref TEXT,
+                     created_at TEXT)''')
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_ledger_ref ON balance_ledger (ref)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user ON balance_ledger (user_id)")
+        # opening entries, so each user's balance equals the sum of their ledger rows
+        c.execute('''INSERT INTO balance_ledger (user_id, amount, reason, created_at)
+                     SELECT user_id, balance, 'opening', ? FROM users WHERE balance != 0''',
+                  (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),))
+    
+    def check_hot_query_plans(self):
+        """Return the HOT_QUERIES whose EXPLAIN QUERY PLAN contains a full table scan.
+        
+        A SCAN that walks an index ("SCAN t USING INDEX ...") is not a full scan.
+        """
+        offenders = []
+        for query, params in self.HOT_QUERIES:
+            plan = self.conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+            scans = [row['detail'] for row in plan
+                     if row['detail'].startswith('SCAN') and not INDEX_SCAN_PATTERN.search(row['detail'])]
+            if scans:
+                offenders.append((' '.join(query.split()), scans))
+        return offenders
+    
     def execute(self, query, params=()):
-        with self._lock:
+        if self.in_transaction():
+            # the enclosing transaction() commits; never reconnect mid-transaction
+            c = self.conn.cursor()
+            c.execute(query, params)
+            return c
+        with self.writer():
             try:
                 c = self.conn.cursor()
                 c.execute(query, params)
-                self.conn.commit()
+                self._commit()
                 return c
             except sqlite3.Error as e:
                 logger.error(f"Database error: {e}")
                 try:
-                    self.conn = sqlite3.connect('bot_database.db', check_same_thread=False, timeout=30)
-                    self.conn.row_factory = sqlite3.Row
-                    c = self.conn.cursor()
+                    c = self._reconnect().cursor()
                     c.execute(query, params)
-                    self.conn.commit()
+                    self._commit()
                     return c
                 except sqlite3.Error as e2:
                     logger.error(f"Database reconnection failed: {e2}")
                     raise
     
+    def executemany(self, query, seq_of_params):
+        if self.in_transaction():
+            return self.conn.executemany(query, seq_of_params)
+        with self.transaction():
+            return self.conn.executemany(query, seq_of_params)
+    
+    def query(self, query, params=()):
+        """Run a read-only statement on this thread's connection, without the writer lock."""
+        try:
+            c = self.conn.cursor()
+            c.execute(query, params)
+            return c
+        except sqlite3.Error as e:
+            logger.error(f"Database error: {e}")
+            if self.in_transaction():
+                raise
+            try:
+                c = self._reconnect().cursor()
+                c.execute(query, params)
+                return c
+            except sqlite3.Error as e2:
+                logger.error(f"Database reconnection failed: {e2}")
+                raise
+    
     def fetchone(self, query, params=()):
         try:
-            c = self.execute(query, params)
+            c = self.query(query, params)
             result = c.fetchone()
             if result:
                 return dict(result)
@@ -291,7 +578,7 @@ class Database:
     
     def fetchall(self, query, params=()):
         try:
-            c = self.execute(query, params)
+            c = self.query(query, params)
             rows = c.fetchall()
             return [dict(row) for row in rows]
         except Exception as e:
@@ -301,16 +588,328 @@ class Database:
 # Initialize database
 db = Database()
 
+class CountryAvailability:
+    """In-memory count of assignable numbers per country.
+    
+    Loaded from the database by reconcile() and then adjusted in place on
+    assign, reset, import and delete, so the country keyboard never has to
+    scan the numbers table. A periodic reconcile() corrects any drift.
+    """
+    RECONCILE_INTERVAL = 600  # seconds
+    
+    def __init__(self):
+        self._lock = Lock()
+        self._countries = {}  # code -> {'name', 'flag', 'code', 'available_count'}
+        self._snapshot = None
+        self.last_reconciled = None
+    
+    def reconcile(self):
+        # Writers hold db.writer() across their commit and the matching adjust(),
+        # so holding it here across the count and the swap means every change is
+        # either in the count or adjusted afterwards, never both.
+        with db.writer():
+            self._reconcile()
+    
+    def _reconcile(self):
+        rows = db.fetchall('''SELECT c.name, c.flag, c.code,
+                                     COUNT(n.id) as available_count
+                              FROM countries c
+                              JOIN numbers n ON c.code = n.country_code
+                              WHERE n.is_used = 0 
+                              AND NOT EXISTS (
+                                  SELECT 1 FROM number_assignments na 
+                                  WHERE na.number = n.number AND na.is_active = 1
+                              )
+                              GROUP BY c.code, c.name, c.flag''')
+        fresh = {row['code']: row for row in rows}
+        with self._lock:
+            initial = self.last_reconciled is None
+            drift = {code for code in set(fresh) | set(self._countries)
+                     if (fresh.get(code) or {}).get('available_count') != (self._countries.get(code) or {}).get('available_count')}
+            self._countries = fresh
+            self._snapshot = None
+            self.last_reconciled = datetime.now()
+        if drift and not initial:
+            logger.info(f"Availability reconciled, corrected {len(drift)} countries")
+    
+    def adjust(self, code, delta, name=None, flag=None):
+        with self._lock:
+            entry = self._countries.get(code)
+            if entry is None:
+                if name is None:
+                    return False
+                entry = {'name': name, 'flag': flag, 'code': code, 'available_count': 0}
+                self._countries[code] = entry
+            entry['available_count'] = max(0, entry['available_count'] + delta)
+            self._snapshot = None
+        return True
+    
+    def remove(self, code):
+        with self._lock:
+            self._countries.pop(code, None)
+            self._snapshot = None
+    
+    def snapshot(self):
+        """Countries with free numbers, sorted by name. Rebuilt only after a change."""
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = sorted(
+                    (dict(c) for c in self._countries.values() if c['available_count'] > 0),
+                    key=lambda c: c['name'] or '')
+            return self._snapshot
+
+availability = CountryAvailability()
+
+class LatencyHistogram:
+    """Thread-safe bucketed latency histogram (seconds)."""
+    BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._lock = Lock()
+    
+    def observe(self, seconds):
+        bucket = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                bucket = i
+                break
+        with self._lock:
+            self._counts[bucket] += 1
+    
+    def percentile(self, pct):
+        """Upper bucket bound holding the pct-th percentile (None if no data)."""
+        with self._lock:
+            total = sum(self._counts)
+            if not total:
+                return None
+            running = 0
+            for i, count in enumerate(self._counts):
+                running += count
+                if running >= total * pct / 100:
+                    return self.buckets[i] if i < len(self.buckets) else float('inf')
+    
+    def snapshot(self):
+        with self._lock:
+            return dict(zip([*map(str, self.buckets), 'inf'], self._counts))
+
+# group message received -> user DM delivered, for both the fast path and the OTP processor
+otp_latency = LatencyHistogram()
+
+class TokenBucket:
+    """Blocking token bucket for outgoing Telegram calls.
+    
+    pause() stops every sender until a 429's retry_after has passed, since
+    Telegram's flood limit applies to the whole bot.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = Lock()
+    
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+    
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+TELEGRAM_RATE = 28  # messages per second, under Telegram's ~30/s global bot limit
+# one bucket for the whole process: the delivery queue, the OTP processor and broadcasts all draw from it
+telegram_bucket = TokenBucket(TELEGRAM_RATE)
+
+class DeliveryQueue:
+    """Background Telegram sender.
+    
+    Jobs are sharded over worker threads by chat id, so messages to one chat
+    keep their order while different chats are sent in parallel. 429 responses
+    are retried after Telegram's retry_after, 5xx and network errors with
+    exponential backoff. Every send draws from telegram_bucket, and a 429
+    pauses that bucket for all senders. Enqueue-to-delivery latency goes
+    into a histogram.
+    """
+    WORKERS = 8
+    MAX_RETRIES = 5
+    BASE_BACKOFF = 1.0  # seconds, doubled per attempt
+    
+    def __init__(self, workers=WORKERS):
+        self._queues = [Queue() for _ in range(workers)]
+        self._stats_lock = Lock()
+        self.latency = LatencyHistogram()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+    
+    def start(self):
+        for i, q in enumerate(self._queues):
+            Thread(target=self._worker, args=(q,), name=f"delivery-{i}", daemon=True).start()
+    
+    def submit(self, chat_id, method, *args, on_sent=None, on_failed=None, **kwargs):
+        """Queue bot.<method>(chat_id, *args, **kwargs); callbacks run on the worker thread."""
+        job = (time.time(), chat_id, method, args, kwargs, on_sent, on_failed)
+        self._queues[hash(chat_id) % len(self._queues)].put(job)
+    
+    def _worker(self, q):
+        while True:
+            job = q.get()
+            try:
+                self._run(job)
+            except Exception as e:
+                logger.error(f"Delivery worker error: {e}")
+                logger.error(traceback.format_exc())
+            finally:
+                q.task_done()
+    
+    def _run(self, job):
+        enqueued, chat_id, method, args, kwargs, on_sent, on_failed = job
+        attempt = 0
+        while True:
+            telegram_bucket.acquire()
+            try:
+                result = getattr(bot, method)(chat_id, *args, **kwargs)
+                break
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                attempt += 1
+                if delay is None or attempt > self.MAX_RETRIES:
+                    logger.error(f"Delivery {method} to {chat_id} failed after {attempt} attempt(s): {e}")
+                    self._record(enqueued, False)
+                    if on_failed:
+                        on_failed(e)
+                    return
+                with self._stats_lock:
+                    self.retried += 1
+                if getattr(e, 'error_code', None) == 429:
+                    telegram_bucket.pause(delay)
+                else:
+                    time.sleep(delay)
+        self._record(enqueued, True)
+        if on_sent:
+            on_sent(result)
+    
+    @classmethod
+    def retry_delay(cls, error, attempt):
+        """Seconds to wait before retrying error, or None if it is not retryable."""
+        code = getattr(error, 'error_code', None)
+        if code == 429:
+            try:
+                return float(error.result_json['parameters']['retry_after'])
+            except Exception:
+                return cls.BASE_BACKOFF * 2 ** attempt
+        if code is not None and code >= 500:
+            return cls.BASE_BACKOFF * 2 ** attempt
+        if isinstance(error, requests.exceptions.RequestException):
+            return cls.BASE_BACKOFF * 2 ** attempt
+        return None
+    
+    def _record(self, enqueued, ok):
+        self.latency.observe(time.time() - enqueued)
+        with self._stats_lock:
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+    
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'sent': self.sent,
+                'failed': self.failed,
+                'retried': self.retried,
+                'pending': sum(q.qsize() for q in self._queues),
+                'histogram': self.latency.snapshot(),
+            }
+
+delivery = DeliveryQueue()
+
+class SettingsCache:
+    """In-memory copy of the single settings row.
+    
+    The row is read once and kept until update_setting invalidates it, so
+    get_setting and the typed accessors below do not touch the database.
+    A failed read is not cached: the last good row is served and the read
+    is retried on the next access.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._row = None
+        self._last_good = {}
+        self.loads = 0
+    
+    def _snapshot(self):
+        row = self._row
+        if row is None:
+            with self._lock:
+                row = self._row
+                if row is None:
+                    row = db.fetchone("SELECT * FROM settings WHERE id = 1")
+                    if not row:
+                        logger.error("Could not load settings, using the last known values")
+                        return self._last_good
+                    self._row = self._last_good = row
+                    self.loads += 1
+        return row
+    
+    def invalidate(self):
+        with self._lock:
+            self._row = None
+    
+    def get(self, key):
+        return self._snapshot().get(key)
+    
+    def _value(self, key, cast, default):
+        value = self.get(key)
+        return cast(value) if value else default
+    
+    @property
+    def batch_size(self):
+        return self._value('batch_size', int, 1)
+    
+    @property
+    def revenue_per_message(self):
+        return self._value('revenue_per_message', float, 0.005)
+    
+    @property
+    def min_withdrawal(self):
+        return self._value('min_withdrawal', float, 3.0)
+    
+    @property
+    def max_user_numbers(self):
+        return self._value('max_user_numbers', int, 50)
+    
+    @property
+    def withdrawal_enabled(self):
+        return self.get('withdrawal_enabled') != 0
+    
+    @property
+    def bot_enabled(self):
+        return self.get('bot_enabled') != 0
+
+settings = SettingsCache()
+
 # Utility functions
 def is_admin(user_id):
     return user_id in ADMIN_IDS
 
 def get_setting(key):
     try:
-        result = db.fetchone(f"SELECT {key} FROM settings WHERE id = 1")
-        if result:
-            return result[key]
-        return None
+        return settings.get(key)
     except Exception as e:
         logger.error(f"Error getting setting {key}: {e}")
         return None
@@ -319,6 +918,7 @@ def update_setting(key, value):
     try:
         query = f"UPDATE settings SET {key} = ? WHERE id = 1"
         db.execute(query, (value,))
+        settings.invalidate()
         return True
     except Exception as e:
         logger.error(f"Error updating setting {key}: {e}")
@@ -334,133 +934,260 @@ def get_user_balance(user_id):
         logger.error(f"Error getting user balance: {e}")
         return 0.0
 
-def update_user_balance(user_id, amount):
-    try:
-        current = get_user_balance(user_id)
-        new_balance = current + amount
-        db.execute("UPDATE users SET balance = ? WHERE user_id = ?", (new_balance, user_id))
-        return new_balance
-    except Exception as e:
-        logger.error(f"Error updating user balance: {e}")
-        return current
+def otp_ref(chat_id, message_id):
+    """Ledger idempotency key for the credit of one group message.
+    
+    Message ids are only unique within a chat, so the chat is part of the key.
+    """
+    return f"otp:{chat_id}:{message_id}" if message_id else None
 
-def add_revenue_to_user(user_id, amount):
-    try:
-        # Update balance
-        new_balance = update_user_balance(user_id, amount)
-        
-        # Update total earned
-        db.execute("UPDATE users SET total_earned = total_earned + ? WHERE user_id = ?", (amount, user_id))
-        
-        # Update total OTP received count
-        db.execute("UPDATE users SET total_otp_received = total_otp_received + 1 WHERE user_id = ?", (user_id,))
+def update_user_balance(user_id, amount, reason='adjustment', ref=None, require_funds=False):
+    """Add amount to the user's balance and append it to balance_ledger.
+    
+    The balance is changed in SQL, so concurrent credits never lose updates.
+    A ref makes the call idempotent; require_funds refuses debits that would
+    overdraw. Returns the new balance, or None if nothing was applied.
+    """
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with db.transaction():
+        entry = db.execute('''INSERT OR IGNORE INTO balance_ledger (user_id, amount, reason, ref, created_at)
+                              VALUES (?, ?, ?, ?, ?)''', (user_id, amount, reason, ref, now))
+        if not entry.rowcount:
+            return None  # ref already applied
+        
+        if require_funds:
+            updated = db.execute("UPDATE users SET balance = balance + ? WHERE user_id = ? AND balance + ? >= 0",
+                                 (amount, user_id, amount))
+        else:
+            updated = db.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (amount, user_id))
+        if not updated.rowcount:
+            db.execute("DELETE FROM balance_ledger WHERE id = ?", (entry.lastrowid,))
+            return None
         
-        # Update today's revenue stats
-        today = datetime.now().strftime("%Y-%m-%d")
-        db.execute('''INSERT OR IGNORE INTO user_stats (user_id, date) VALUES (?, ?)''', (user_id, today))
-        db.execute('''UPDATE user_stats SET revenue_earned = revenue_earned + ? 
-                       WHERE user_id = ? AND date = ?''', (amount, user_id, today))
-        return True
+        return db.fetchone("SELECT balance FROM users WHERE user_id = ?", (user_id,))['balance']
+
+def credit_otps(credits):
+    """Apply a batch of OTP credits in one transaction.
+    
+    credits is a list of (user_id, amount, ref, number, otp_date). Balance
+    (through the ledger), total_earned, total_otp_received, today's user_stats
+    and the number's assignment counters are summed per user / per number and
+    written with one executemany each. Entries whose ref is already in the
+    ledger, or repeated within the batch, are skipped. Returns the credits
+    that were applied.
+    """
+    if not credits:
+        return []
+    now = datetime.now()
+    created = now.strftime("%Y-%m-%d %H:%M:%S")
+    today = now.strftime("%Y-%m-%d")
+    with db.transaction():
+        refs = [ref for _, _, ref, _, _ in credits if ref]
+        applied = set()
+        for i in range(0, len(refs), 500):
+            chunk = refs[i:i + 500]
+            applied.update(row['ref'] for row in db.fetchall(
+                "SELECT ref FROM balance_ledger WHERE ref IN (%s)" % ','.join('?' * len(chunk)), chunk))
+        
+        credited = []
+        user_totals = {}
+        assignment_totals = {}
+        for credit in credits:
+            user_id, amount, ref, number, otp_date = credit
+            if ref:
+                if ref in applied:
+                    continue
+                applied.add(ref)
+            credited.append(credit)
+            total, count = user_totals.get(user_id, (0.0, 0))
+            user_totals[user_id] = (total + amount, count + 1)
+            if number:
+                otp_count, revenue, last_otp = assignment_totals.get((number, user_id), (0, 0.0, ''))
+                assignment_totals[(number, user_id)] = (otp_count + 1, revenue + amount, max(last_otp, otp_date or ''))
+        
+        db.executemany('''INSERT INTO balance_ledger (user_id, amount, reason, ref, created_at)
+                          VALUES (?, ?, 'otp', ?, ?)''',
+                       [(user_id, amount, ref, created) for user_id, amount, ref, _, _ in credited])
+        db.executemany('''UPDATE users SET balance = balance + ?, total_earned = total_earned + ?,
+                                         total_otp_received = total_otp_received + ?
+                          WHERE user_id = ?''',
+                       [(total, total, count, user_id) for user_id, (total, count) in user_totals.items()])
+        db.executemany('''INSERT INTO user_stats (user_id, date, messages_received, revenue_earned)
+                          VALUES (?, ?, ?, ?)
+                          ON CONFLICT(user_id, date) DO UPDATE SET
+                              messages_received = messages_received + excluded.messages_received,
+                              revenue_earned = revenue_earned + excluded.revenue_earned''',
+                       [(user_id, today, count, total) for user_id, (total, count) in user_totals.items()])
+        db.executemany('''UPDATE number_assignments 
+                          SET otp_count = otp_count + ?, 
+                              total_revenue = total_revenue + ?,
+                              last_otp_date = ?
+                          WHERE number = ? AND user_id = ?''',
+                       [(otp_count, revenue, last_otp or None, number, user_id)
+                        for (number, user_id), (otp_count, revenue, last_otp) in assignment_totals.items()])
+    return credited
+
+def credit_otp(user_id, amount, ref=None, number=None, otp_date=None):
+    """Single-message form of credit_otps; returns False if ref was already credited."""
+    try:
+        return bool(credit_otps([(user_id, amount, ref, number, otp_date)]))
     except Exception as e:
-        logger.error(f"Error adding revenue: {e}")
+        logger.error(f"Error crediting OTP for {user_id}: {e}")
+        if db.in_transaction():
+            raise
         return False
 
 def increment_user_message_count(user_id, is_otp=False):
     """Increment the message count for the user for today."""
     try:
         today = datetime.now().strftime("%Y-%m-%d")
-        db.execute('''INSERT OR IGNORE INTO user_stats (user_id, date) VALUES (?, ?)''', (user_id, today))
-        
-        if is_otp:
-            db.execute('''UPDATE user_stats SET messages_received = messages_received + 1 
-                          WHERE user_id = ? AND date = ?''', (user_id, today))
+        db.execute('''INSERT INTO user_stats (user_id, date, messages_received) VALUES (?, ?, ?)
+                      ON CONFLICT(user_id, date) DO UPDATE SET
+                          messages_received = messages_received + excluded.messages_received''',
+                   (user_id, today, 1 if is_otp else 0))
         return True
     except Exception as e:
         logger.error(f"Error incrementing message count: {e}")
         return False
 
+class RateLimiter:
+    """In-memory sliding-window limiter for the Get Number button.
+    
+    Users are spread over lock stripes so concurrent presses from different
+    users rarely contend. Each user keeps the timestamps of their last LIMIT
+    presses; one more press inside WINDOW seconds starts a SUSPENSION. Only
+    the start of a suspension is written to rate_limits, on a background
+    thread, so suspensions survive restarts without spam hitting SQLite.
+    """
+    LIMIT = 4  # presses allowed per window
+    WINDOW = 60  # seconds
+    SUSPENSION = 15 * 60  # seconds
+    STRIPES = 64
+    
+    def __init__(self):
+        self._locks = [Lock() for _ in range(self.STRIPES)]
+        self._presses = [{} for _ in range(self.STRIPES)]
+        self._suspended = [{} for _ in range(self.STRIPES)]  # user_id -> wall-clock end
+        self._persist_pool = ThreadPoolExecutor(max_workers=1)
+    
+    def load_suspensions(self):
+        """Restore suspensions that were still running when the bot stopped."""
+        now = datetime.now()
+        rows = db.fetchall('''SELECT user_id, suspend_until FROM rate_limits 
+                              WHERE is_suspended = 1 AND suspend_until > ?''',
+                           (now.strftime("%Y-%m-%d %H:%M:%S"),))
+        for row in rows:
+            until = datetime.strptime(row['suspend_until'], "%Y-%m-%d %H:%M:%S").timestamp()
+            stripe = row['user_id'] % self.STRIPES
+            with self._locks[stripe]:
+                self._suspended[stripe][row['user_id']] = until
+    
+    def check(self, user_id):
+        """Record a press; returns (allowed, message)."""
+        stripe = user_id % self.STRIPES
+        now = time.time()
+        with self._locks[stripe]:
+            until = self._suspended[stripe].get(user_id)
+            if until is not None:
+                if now < until:
+                    remaining = int(until - now) // 60
+                    return False, f"🚫 You are suspended for {remaining} minutes for spamming. Please wait."
+                del self._suspended[stripe][user_id]
+            
+            presses = self._presses[stripe].get(user_id)
+            if presses is None:
+                presses = self._presses[stripe][user_id] = deque(maxlen=self.LIMIT)
+            if len(presses) == self.LIMIT and now - presses[0] < self.WINDOW:
+                until = now + self.SUSPENSION
+                self._suspended[stripe][user_id] = until
+                presses.clear()
+                self._persist_pool.submit(self._persist_suspension, user_id, until)
+                return False, "🚫 You have been suspended for 15 minutes for clicking too fast (4+ times in 1 minute). Please wait."
+            presses.append(now)
+        return True, ""
+    
+    def _persist_suspension(self, user_id, until):
+        try:
+            db.execute('''INSERT INTO rate_limits (user_id, is_suspended, suspend_until) VALUES (?, 1, ?)
+                          ON CONFLICT(user_id) DO UPDATE SET is_suspended = 1, suspend_until = excluded.suspend_until''',
+                       (user_id, datetime.fromtimestamp(until).strftime("%Y-%m-%d %H:%M:%S")))
+        except Exception as e:
+            logger.error(f"Error persisting suspension for {user_id}: {e}")
+
+rate_limiter = RateLimiter()
+
 def check_rate_limit(user_id):
     """Check if user is rate limited for get number button"""
     try:
-        now = datetime.now()
-        
-        result = db.fetchone("SELECT * FROM rate_limits WHERE user_id = ?", (user_id,))
-        
-        if not result:
-            db.execute('''INSERT INTO rate_limits (user_id, get_number_count, last_reset) 
-                          VALUES (?, 1, ?)''', (user_id, now.strftime("%Y-%m-%d %H:%M:%S")))
-            return True, ""
-        
-        last_reset = datetime.strptime(result['last_reset'], "%Y-%m-%d %H:%M:%S")
-        
-        # Reset counter if more than 1 minute passed
-        if (now - last_reset).seconds > 60:
-            db.execute('''UPDATE rate_limits SET get_number_count = 1, last_reset = ?, 
-                          is_suspended = 0, suspend_until = NULL WHERE user_id = ?''',
-                       (now.strftime("%Y-%m-%d %H:%M:%S"), user_id))
-            return True, ""
-        
-        # Check if suspended
-        if result['is_suspended'] == 1 and result['suspend_until']:
-            suspend_until = datetime.strptime(result['suspend_until'], "%Y-%m-%d %H:%M:%S")
-            if now < suspend_until:
-                remaining = (suspend_until - now).seconds // 60
-                return False, f"🚫 You are suspended for {remaining} minutes for spamming. Please wait."
-        
-        # Check count
-        if result['get_number_count'] >= 4:
-            suspend_until = now + timedelta(minutes=15)
-            db.execute('''UPDATE rate_limits SET is_suspended = 1, suspend_until = ? 
-                          WHERE user_id = ?''', (suspend_until.strftime("%Y-%m-%d %H:%M:%S"), user_id))
-            return False, "🚫 You have been suspended for 15 minutes for clicking too fast (4+ times in 1 minute). Please wait."
-        
-        db.execute("UPDATE rate_limits SET get_number_count = get_number_count + 1 WHERE user_id = ?", (user_id,))
-        return True, ""
+        return rate_limiter.check(user_id)
     except Exception as e:
         logger.error(f"Error in rate limit: {e}")
         return True, ""
 
-def extract_otp_from_message(text):
-    """Extract OTP code from message text - enhanced for all formats"""
-    if not text:
-        return None
-    
-    text = str(text).strip()
+class OTPExtractor:
+    """Single-pass OTP finder.
     
-    patterns = [
-        r'\b\d{4,8}\b',
-        r'code[:\s\-]*(\d{4,8})',
-        r'OTP[:\s\-]*(\d{4,8})',
-        r'verification[:\s\-]*(\d{4,8})',
-        r'password[:\s\-]*(\d{4,8})',
-        r'(\d{4,8})\s+is your',
-        r'(\d{4,8})\s+is the',
-        r'Your.*code.*is.*(\d{4,8})',
-        r'Use.*(\d{4,8})',
-        r'[Cc]ode.*\s(\d{4,8})',
-        r'\b[A-Z0-9]{4,8}\b'
-    ]
+    One precompiled alternation scans the text once. Each alternative carries a
+    confidence: codes anchored to a keyword ("code: 123456", "123456 is your")
+    beat split codes ("123-456"), which beat bare 4-8 digit runs, which beat
+    mixed letter/digit tokens. Results are memoized per Telegram message id.
+    """
+    KEYWORD_CONFIDENCE = 0.95
+    CONFIDENCE = {
+        'kw_after': KEYWORD_CONFIDENCE,
+        'kw_before': KEYWORD_CONFIDENCE,
+        'split': 0.8,
+        'bare': 0.6,
+        'alnum': 0.4,
+    }
+    PATTERN = re.compile(
+        r'(?:code|otp|pin|passcode|password|verification)\w*[^\w\n]{0,3}(?:(?:is|as)[^\w\n]{1,3})?'
+        r'(?P<kw_after>\d{3}[- ]\d{3}(?![\w-])|\d{4,8}(?!\d))'
+        r'|(?<![\w+])(?P<kw_before>\d{4,8})\s+(?:is|as)\s+(?:your|the)\b'
+        # digit groups that belong to a longer spaced/dashed number (a phone) are skipped
+        r'|(?<![\w+])(?<!\d[ -])(?P<split>\d{3}[- ]\d{3})(?![\w-])(?! \d)'
+        r'|(?<![\w+])(?<!\d[ -])(?P<bare>\d{4,8})(?!\w)(?![ -]\d)'
+        r'|\b(?P<alnum>(?=[A-Z]*\d)(?=\d*[A-Z])[A-Z0-9]{4,8})\b',
+        re.IGNORECASE)
+    MEMO_SIZE = 10000
     
-    for pattern in patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE | re.MULTILINE)
-        if matches:
-            for match in matches:
-                if isinstance(match, tuple):
-                    match = match[0]
-                if re.match(r'^[A-Z0-9]{4,8}$', match, re.IGNORECASE):
-                    return match
-    
-    special_patterns = [
-        r'(\d{4,8})\s*(?:is|as)\s*(?:your|the)\s*(?:code|OTP|verification|password)',
-        r'(?:code|OTP|verification|password)\s*(?:is|:)\s*(\d{4,8})'
-    ]
+    def __init__(self):
+        self._memo = OrderedDict()
+        self._lock = Lock()
     
-    for pattern in special_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match and match.group(1):
-            return match.group(1)
+    def scan(self, text):
+        """Return (code, confidence) for the most likely OTP in text, or (None, 0.0)."""
+        if not text:
+            return None, 0.0
+        best, best_conf = None, 0.0
+        for match in self.PATTERN.finditer(str(text)):
+            kind = match.lastgroup
+            conf = self.CONFIDENCE[kind]
+            if conf > best_conf:
+                best, best_conf = match.group(kind), conf
+                if conf >= self.KEYWORD_CONFIDENCE:
+                    break
+        return best, best_conf
     
-    return None
+    def extract(self, text, message_id=None):
+        if message_id is None:
+            return self.scan(text)
+        with self._lock:
+            if message_id in self._memo:
+                self._memo.move_to_end(message_id)
+                return self._memo[message_id]
+        result = self.scan(text)
+        with self._lock:
+            self._memo[message_id] = result
+            if len(self._memo) > self.MEMO_SIZE:
+                self._memo.popitem(last=False)
+        return result
+
+otp_extractor = OTPExtractor()
+
+def extract_otp_from_message(text, message_id=None):
+    """Extract OTP code from message text - enhanced for all formats"""
+    return otp_extractor.extract(text, message_id)[0]
 
 def extract_number_from_text(text):
     """Extract phone number from text - enhanced for all international formats"""
@@ -508,21 +1235,7 @@ def extract_number_from_text(text):
 
 def get_country_from_number(number):
     """Get country information from phone number using phonenumbers and pycountry"""
-    try:
-        number = str(number).strip()
-        parsed = phonenumbers.parse(number)
-        country_code = phonenumbers.region_code_for_number(parsed)
-        
-        if country_code:
-            country = pycountry.countries.get(alpha_2=country_code)
-            if country:
-                flag = get_flag_emoji(country_code)
-                return flag, country.name
-        
-        return ('🌍', 'Unknown')
-    except Exception as e:
-        logger.error(f"Error getting country from number {number}: {e}")
-        return ('🌍', 'Unknown')
+    return country_resolver.resolve(str(number).strip())
 
 def get_flag_emoji(country_code):
     """Convert country code to flag emoji"""
@@ -534,10 +1247,75 @@ def get_flag_emoji(country_code):
     except:
         return '🏳️'
 
-def format_otp_message(number, message_text, timestamp, revenue_added=False, user_balance=0.0, revenue_earned=0.0):
+class CountryResolver:
+    """Memoized phone number -> (flag, country name) lookup.
+    
+    Gives the same answers as parsing with phonenumbers. A plain "+digits"
+    number whose calling code belongs to a single region (most of them) is
+    resolved from a prefix table without calling phonenumbers.parse, as long
+    as its national part has a length parse would accept. Everything else
+    (shared calling codes such as +1, +7, +44, or formatted input) takes the
+    full parse. Results go into a bounded LRU keyed on the full number. The
+    region -> (flag, name) table is built once at startup.
+    """
+    UNKNOWN = ('🌍', 'Unknown')
+    CACHE_SIZE = 100000
+    NSN_LENGTHS = (2, 17)  # national number lengths phonenumbers.parse accepts
+    
+    def __init__(self):
+        self._regions = {}
+        self._prefixes = {}  # calling code digits -> (flag, name), or None when shared
+        for calling_code, regions in phonenumbers.COUNTRY_CODE_TO_REGION_CODE.items():
+            for region in regions:
+                if region not in self._regions:
+                    self._regions[region] = self._lookup_region(region)
+            self._prefixes[str(calling_code)] = self._regions[regions[0]] if len(regions) == 1 else None
+        self._max_prefix = max((len(p) for p in self._prefixes), default=0)
+        self._resolve_cached = lru_cache(maxsize=self.CACHE_SIZE)(self._resolve)
+    
+    def _lookup_region(self, region):
+        # phonenumbers also lists non-geographic entities such as "001"
+        try:
+            country = pycountry.countries.get(alpha_2=region)
+        except (KeyError, LookupError):
+            country = None
+        return (get_flag_emoji(region), country.name) if country else self.UNKNOWN
+    
+    def region_info(self, region):
+        return self._regions.get(region, self.UNKNOWN)
+    
+    def _resolve(self, number):
+        digits = number[1:]
+        if number.startswith('+') and digits.isdigit():
+            # calling codes are prefix-free, so at most one length matches
+            for length in range(1, min(self._max_prefix, len(digits)) + 1):
+                prefix = digits[:length]
+                if prefix in self._prefixes:
+                    info = self._prefixes[prefix]
+                    low, high = self.NSN_LENGTHS
+                    if info is not None and low <= len(digits) - length <= high:
+                        return info
+                    break
+        try:
+            parsed = phonenumbers.parse(number)
+            return self.region_info(phonenumbers.region_code_for_number(parsed))
+        except Exception as e:
+            logger.error(f"Error getting country from number {number}: {e}")
+            return self.UNKNOWN
+    
+    def resolve(self, number):
+        return self._resolve_cached(number)
+    
+    def cache_info(self):
+        return self._resolve_cached.cache_info()
+
+country_resolver = CountryResolver()
+
+def format_otp_message(number, message_text, timestamp, revenue_added=False, user_balance=0.0, revenue_earned=0.0,
+                       message_id=None):
     """Format OTP message in the specified style"""
     country_flag, country_name = get_country_from_number(number)
-    otp_code = extract_otp_from_message(message_text)
+    otp_code = extract_otp_from_message(message_text, message_id)
     
     message = f"""🆕 Text Message Found!
 
@@ -549,92 +1327,149 @@ def format_otp_message(number, message_text, timestamp, revenue_added=False, use
     
     return message, otp_code, country_flag, country_name
 
+OTP_BATCH_SIZE = 100
+OTP_SEND_WORKERS = 8
+OTP_SAFETY_POLL_INTERVAL = 60  # seconds; the processor is normally woken by signal_otp_processor
+OTP_QUEUE_TIMEOUT = 120  # seconds a row may sit with the delivery queue before the processor takes it back
+otp_pending = threading.Event()
+
+def otp_queue_cutoff():
+    """Rows with queued_at before this were lost by the delivery queue and are picked up again."""
+    return (datetime.now() - timedelta(seconds=OTP_QUEUE_TIMEOUT)).strftime("%Y-%m-%d %H:%M:%S")
+
+def _send_user_otps(jobs):
+    """Send one user's OTP messages in order; returns the jobs that were delivered.
+    
+    Retries and 429 handling follow DeliveryQueue: a 429 pauses telegram_bucket
+    for every sender before the message is tried again.
+    """
+    delivered = []
+    for job in jobs:
+        attempt = 0
+        while True:
+            telegram_bucket.acquire()
+            try:
+                bot.send_message(job['user_id'], job['text'], reply_markup=job['markup'], parse_mode='Markdown')
+                otp_latency.observe(time.time() - job['received'].timestamp())
+                delivered.append(job)
+                break
+            except Exception as e:
+                delay = DeliveryQueue.retry_delay(e, attempt)
+                attempt += 1
+                if delay is None or attempt > DeliveryQueue.MAX_RETRIES:
+                    logger.error(f"Error sending to user {job['user_id']}: {e}")
+                    break
+                if getattr(e, 'error_code', None) == 429:
+                    telegram_bucket.pause(delay)
+                else:
+                    time.sleep(delay)
+    return delivered
+
 def process_bulk_otp_messages():
-    """Process OTP messages in bulk for efficiency"""
+    """Process OTP messages in bulk for efficiency; returns the number of rows picked up"""
     try:
-        messages = db.fetchall('''SELECT * FROM otp_messages 
-                                  WHERE processed = 0 
-                                  ORDER BY timestamp ASC LIMIT 100''')
+        messages = db.fetchall('''SELECT o.*, a.user_id AS assigned_user, u.balance AS user_balance
+                                  FROM otp_messages o
+                                  LEFT JOIN number_assignments a ON a.number = o.number AND a.is_active = 1
+                                  LEFT JOIN users u ON u.user_id = a.user_id
+                                  WHERE o.processed = 0 AND o.forwarded_to = 0
+                                  AND (o.queued_at IS NULL OR o.queued_at < ?)
+                                  ORDER BY o.timestamp ASC LIMIT ?''', (otp_queue_cutoff(), OTP_BATCH_SIZE))
         
         if not messages:
-            return
+            return 0
+        
+        revenue = settings.revenue_per_message
         
+        # build every outgoing message up front, grouped per user so each chat keeps its order
+        per_user = {}
         for msg in messages:
+            user_id = msg['assigned_user']
+            if not user_id:
+                continue
             try:
-                assignment = db.fetchone('''SELECT user_id FROM number_assignments 
-                                            WHERE number = ? AND is_active = 1''', (msg['number'],))
+                otp_code = extract_otp_from_message(msg['message'], msg['message_id'])
+                is_otp = otp_code is not None
+                credit = is_otp and msg['revenue_added'] == 0
+                received = datetime.strptime(msg['timestamp'], "%Y-%m-%d %H:%M:%S")
                 
-                if assignment:
-                    user_id = assignment['user_id']
-                    current_balance = get_user_balance(user_id)
-                    otp_code = extract_otp_from_message(msg['message'])
-                    is_otp = otp_code is not None
-                    revenue = get_setting('revenue_per_message') or 0.005
-                    
-                    formatted_msg, otp_code, flag, country = format_otp_message(
-                        msg['number'], msg['message'], 
-                        datetime.strptime(msg['timestamp'], "%Y-%m-%d %H:%M:%S"),
-                        False,
-                        current_balance,
-                        revenue if is_otp and msg['revenue_added'] == 0 else 0.0
-                    )
-                    
-                    markup = types.InlineKeyboardMarkup()
-                    thanks_btn = types.InlineKeyboardButton("🌺 Thanks For Using Our Bot", callback_data="thanks")
-                    markup.add(thanks_btn)
-                    
-                    try:
-                        sent_msg = bot.send_message(user_id, formatted_msg, reply_markup=markup, parse_mode='Markdown')
-                        
-                        db.execute("UPDATE otp_messages SET is_otp = ? WHERE id = ?", 
-                                  (1 if is_otp else 0, msg['id']))
-                        
-                        if is_otp and msg['revenue_added'] == 0:
-                            add_revenue_to_user(user_id, revenue)
-                            increment_user_message_count(user_id, True)
-                            
-                            db.execute('''UPDATE number_assignments 
-                                          SET otp_count = otp_count + 1, 
-                                              total_revenue = total_revenue + ?,
-                                              last_otp_date = ?
-                                          WHERE number = ? AND user_id = ?''',
-                                       (revenue, msg['timestamp'], msg['number'], user_id))
-                            
-                            db.execute("UPDATE otp_messages SET revenue_added = 1 WHERE id = ?", (msg['id'],))
-                        else:
-                            increment_user_message_count(user_id, False)
-                        
-                        db.execute('''UPDATE otp_messages 
-                                      SET forwarded_to = ?, processed = 1 
-                                      WHERE id = ?''', (user_id, msg['id']))
-                        
-                        try:
-                            if MONITORED_GROUP_ID and msg.get('message_id'):
-                                bot.delete_message(MONITORED_GROUP_ID, msg['message_id'])
-                        except Exception as e:
-                            logger.error(f"Could not delete message from group: {e}")
-                        
-                    except Exception as e:
-                        logger.error(f"Error sending to user {user_id}: {e}")
-                        db.execute("UPDATE otp_messages SET processed = 1 WHERE id = ?", (msg['id'],))
-                else:
-                    db.execute("UPDATE otp_messages SET processed = 1 WHERE id = ?", (msg['id'],))
-                    
+                formatted_msg, otp_code, flag, country = format_otp_message(
+                    msg['number'], msg['message'], 
+                    received,
+                    False,
+                    msg['user_balance'] or 0.0,
+                    revenue if credit else 0.0,
+                    msg['message_id']
+                )
+                
+                markup = types.InlineKeyboardMarkup()
+                thanks_btn = types.InlineKeyboardButton("🌺 Thanks For Using Our Bot", callback_data="thanks")
+                markup.add(thanks_btn)
+                
+                per_user.setdefault(user_id, []).append({
+                    'msg': msg, 'user_id': user_id, 'text': formatted_msg, 'markup': markup,
+                    'received': received, 'is_otp': is_otp, 'credit': credit,
+                })
             except Exception as e:
                 logger.error(f"Error processing message {msg.get('id', 'unknown')}: {e}")
-                db.execute("UPDATE otp_messages SET processed = 1 WHERE id = ?", (msg['id'],))
+        
+        delivered = []
+        if per_user:
+            with ThreadPoolExecutor(max_workers=min(OTP_SEND_WORKERS, len(per_user))) as pool:
+                for sent in pool.map(_send_user_otps, per_user.values()):
+                    delivered.extend(sent)
+        
+        with db.transaction():
+            # credits whose ref is already in the ledger (e.g. from the delivery queue) are skipped
+            credit_otps([(job['user_id'], revenue, otp_ref(MONITORED_GROUP_ID, job['msg']['message_id']),
+                          job['msg']['number'], job['msg']['timestamp'])
+                         for job in delivered if job['credit']])
+            
+            db.executemany('''UPDATE otp_messages 
+                              SET is_otp = ?, revenue_added = ?, forwarded_to = ?, processed = 1 
+                              WHERE id = ?''',
+                           [(1 if job['is_otp'] else 0, 1 if job['credit'] else job['msg']['revenue_added'],
+                             job['user_id'], job['msg']['id']) for job in delivered])
+            
+            # unassigned, unsendable and failed rows are marked processed, as before
+            db.execute('''UPDATE otp_messages SET processed = 1 
+                          WHERE processed = 0 AND forwarded_to = 0 AND id IN (%s)'''
+                       % ','.join('?' * len(messages)), [msg['id'] for msg in messages])
+        
+        if MONITORED_GROUP_ID:
+            for job in delivered:
+                if job['msg'].get('message_id'):
+                    delivery.submit(MONITORED_GROUP_ID, 'delete_message', job['msg']['message_id'])
         
         cutoff = (datetime.now() - timedelta(minutes=15)).strftime("%Y-%m-%d %H:%M:%S")
         db.execute("DELETE FROM otp_messages WHERE timestamp < ? AND processed = 1", (cutoff,))
         
+        return len(messages)
+        
     except Exception as e:
         logger.error(f"Error in bulk processing: {e}")
+        return 0
+
+def start_availability_reconciler():
+    while True:
+        time.sleep(CountryAvailability.RECONCILE_INTERVAL)
+        try:
+            availability.reconcile()
+        except Exception as e:
+            logger.error(f"Availability reconcile error: {e}")
+
+def signal_otp_processor():
+    """Wake the OTP processor; call after storing a row it should pick up."""
+    otp_pending.set()
 
 def start_otp_processor():
     while True:
         try:
-            process_bulk_otp_messages()
-            time.sleep(5)
+            # woken by signal_otp_processor; the timeout is only a safety net for missed signals
+            otp_pending.wait(OTP_SAFETY_POLL_INTERVAL)
+            otp_pending.clear()
+            if process_bulk_otp_messages() >= OTP_BATCH_SIZE:
+                otp_pending.set()  # batch was full, more rows are waiting
         except Exception as e:
             logger.error(f"OTP processor error: {e}")
             time.sleep(10)
@@ -645,7 +1480,7 @@ def send_welcome(message):
     try:
         user_id = message.from_user.id
         
-        if not is_admin(user_id) and get_setting('bot_enabled') == 0:
+        if not is_admin(user_id) and not settings.bot_enabled:
             bot.reply_to(message, "⚠️ Service Unavailable!\nThe bot has been temporarily disabled by the admin for maintenance purposes. Please try again after a while.")
             return
         
@@ -669,7 +1504,8 @@ def send_welcome(message):
                        (user_id, message.from_user.username, message.from_user.first_name,
                         message.from_user.last_name, join_date, join_date))
         else:
-            db.execute("UPDATE users SET last_activity = ? WHERE user_id = ?",
+            # a /start after blocking the bot makes the user reachable for broadcasts again
+            db.execute("UPDATE users SET last_activity = ?, blocked_bot = 0 WHERE user_id = ?",
                        (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), user_id))
         
         start_msg_type = get_setting('start_message_type')
@@ -779,24 +1615,13 @@ def handle_get_number(message):
                                          FROM number_assignments 
                                          WHERE user_id = ? AND is_active = 1''', (user_id,))
         current_count = current_active['count'] if current_active else 0
-        max_numbers = get_setting('max_user_numbers') or 50
+        max_numbers = settings.max_user_numbers
         
         if current_count >= max_numbers:
             bot.send_message(message.chat.id, f"❌ You can have maximum {max_numbers} active numbers. Please wait until some expire.")
             return
         
-        countries = db.fetchall('''SELECT DISTINCT c.name, c.flag, c.code,
-                                          COUNT(n.id) as available_count
-                                   FROM countries c
-                                   JOIN numbers n ON c.code = n.country_code
-                                   WHERE n.is_used = 0 
-                                   AND NOT EXISTS (
-                                       SELECT 1 FROM number_assignments na 
-                                       WHERE na.number = n.number AND na.is_active = 1
-                                   )
-                                   GROUP BY c.code, c.name, c.flag
-                                   HAVING available_count > 0
-                                   ORDER BY c.name''')
+        countries = availability.snapshot()
         
         if not countries:
             bot.send_message(message.chat.id, "❌ No countries with available numbers found.")
@@ -814,7 +1639,7 @@ def handle_get_number(message):
         msg = f"🌍 Select a country:\n\n"
         msg += f"📊 Your active numbers: {current_count}/{max_numbers}\n"
         msg += f"📱 Available numbers shown in parentheses\n"
-        msg += f"🎯 Batch size: {get_setting('batch_size') or 1} number(s) per request\n"
+        msg += f"🎯 Batch size: {settings.batch_size} number(s) per request\n"
         
         bot.send_message(message.chat.id, msg, reply_markup=markup)
     except Exception as e:
@@ -828,10 +1653,9 @@ def handle_balance(message):
         
         markup = types.InlineKeyboardMarkup()
         
-        withdrawal_enabled = get_setting('withdrawal_enabled')
-        min_withdrawal = get_setting('min_withdrawal') or 3.0
+        min_withdrawal = settings.min_withdrawal
         
-        if withdrawal_enabled == 1 and balance >= min_withdrawal:
+        if settings.withdrawal_enabled and balance >= min_withdrawal:
             withdraw_btn = types.InlineKeyboardButton("💸 Withdraw", callback_data="withdraw_request")
             markup.add(withdraw_btn)
         
@@ -1190,16 +2014,14 @@ def callback_handler(call):
             show_admin_settings(chat_id)
         
         elif call.data == 'toggle_withdrawal':
-            current = get_setting('withdrawal_enabled')
-            new_status = 0 if current == 1 else 1
+            new_status = 0 if settings.withdrawal_enabled else 1
             update_setting('withdrawal_enabled', new_status)
             status_text = "enabled" if new_status == 1 else "disabled"
             bot.answer_callback_query(call.id, f"✅ Withdrawal {status_text}")
             show_admin_settings(chat_id)
         
         elif call.data == 'toggle_bot':
-            current = get_setting('bot_enabled')
-            new_status = 0 if current == 1 else 1
+            new_status = 0 if settings.bot_enabled else 1
             update_setting('bot_enabled', new_status)
             status_text = "enabled" if new_status == 1 else "disabled"
             bot.answer_callback_query(call.id, f"✅ Bot {status_text}")
@@ -1321,40 +2143,41 @@ def process_user_reset_all(call):
             return
         
         reset_count = 0
-        for assign in assignments:
-            try:
-                db.execute("DELETE FROM numbers WHERE number = ?", (assign['number'],))
-                db.execute("DELETE FROM number_assignments WHERE number = ? AND user_id = ?",
-                           (assign['number'], user_id))
+        with db.transaction():
+            for assign in assignments:
+                try:
+                    db.execute("DELETE FROM numbers WHERE number = ?", (assign['number'],))
+                    db.execute("DELETE FROM number_assignments WHERE number = ? AND user_id = ?",
+                               (assign['number'], user_id))
                 
-                reset_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                db.execute('''INSERT INTO reset_history (user_id, number, country_code, reset_date, reset_type)
-                              VALUES (?, ?, ?, ?, ?)''',
-                           (user_id, assign['number'], assign['country_code'], reset_date, 'user'))
+                    reset_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    db.execute('''INSERT INTO reset_history (user_id, number, country_code, reset_date, reset_type)
+                                  VALUES (?, ?, ?, ?, ?)''',
+                               (user_id, assign['number'], assign['country_code'], reset_date, 'user'))
                 
-                if assign['country_code']:
-                    country = db.fetchone('''SELECT total_numbers, used_numbers 
-                                            FROM countries WHERE code = ?''', 
-                                          (assign['country_code'],))
-                    if country:
-                        total = (country['total_numbers'] or 1) - 1
-                        used = (country['used_numbers'] or 1) - 1
+                    if assign['country_code']:
+                        country = db.fetchone('''SELECT total_numbers, used_numbers 
+                                                FROM countries WHERE code = ?''', 
+                                              (assign['country_code'],))
+                        if country:
+                            total = (country['total_numbers'] or 1) - 1
+                            used = (country['used_numbers'] or 1) - 1
                         
-                        total = max(0, total)
-                        used = max(0, used)
+                            total = max(0, total)
+                            used = max(0, used)
                         
-                        db.execute('''UPDATE countries 
-                                      SET total_numbers = ?, used_numbers = ? 
-                                      WHERE code = ?''', 
-                                   (total, used, assign['country_code']))
+                            db.execute('''UPDATE countries 
+                                          SET total_numbers = ?, used_numbers = ? 
+                                          WHERE code = ?''', 
+                                       (total, used, assign['country_code']))
                 
-                reset_count += 1
+                    reset_count += 1
                 
-                db.execute("DELETE FROM otp_messages WHERE number = ?", (assign['number'],))
-                db.execute("DELETE FROM message_tracking WHERE number = ?", (assign['number'],))
+                    db.execute("DELETE FROM otp_messages WHERE number = ?", (assign['number'],))
+                    db.execute("DELETE FROM message_tracking WHERE number = ?", (assign['number'],))
                 
-            except Exception as e:
-                logger.error(f"Error resetting number {assign['number']}: {e}")
+                except Exception as e:
+                    logger.error(f"Error resetting number {assign['number']}: {e}")
         
         success_msg = f"✅ Reset {reset_count} number assignments.\n\n"
         success_msg += "These numbers have been PERMANENTLY removed from the database and will never be assigned to anyone again."
@@ -1368,6 +2191,54 @@ def process_user_reset_all(call):
         logger.error(f"Error in process_user_reset_all: {e}")
         bot.answer_callback_query(call.id, "❌ An error occurred!")
 
+def claim_numbers(user_id, country_code, batch_size, max_numbers):
+    """Atomically take up to batch_size free numbers of a country for user_id.
+    
+    Selection and marking happen in one IMMEDIATE transaction, so two users
+    racing on the same country can never receive the same number. Returns
+    (claimed_numbers, active_count_before_claim).
+    """
+    assigned_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    today = assigned_date[:10]
+    
+    # the writer lock covers the commit and the availability adjust, see CountryAvailability.reconcile
+    with db.writer():
+        with db.transaction():
+            current_active = db.fetchone('''SELECT COUNT(*) as count 
+                                             FROM number_assignments 
+                                             WHERE user_id = ? AND is_active = 1''', (user_id,))
+            current_count = current_active['count'] if current_active else 0
+            limit = min(batch_size, max_numbers - current_count)
+            if limit <= 0:
+                return [], current_count
+        
+            numbers = db.fetchall('''SELECT number, country, country_flag 
+                                     FROM numbers 
+                                     WHERE country_code = ? AND is_used = 0 
+                                     AND NOT EXISTS (
+                                         SELECT 1 FROM number_assignments na 
+                                         WHERE na.number = numbers.number AND na.is_active = 1
+                                     )
+                                     LIMIT ?''', (country_code, limit))
+            if not numbers:
+                return [], current_count
+        
+            db.executemany('''UPDATE numbers SET is_used = 1, used_by = ?, use_date = ? 
+                              WHERE number = ? AND is_used = 0''',
+                           [(user_id, assigned_date, n['number']) for n in numbers])
+            db.executemany('''INSERT INTO number_assignments (number, user_id, assigned_date)
+                              VALUES (?, ?, ?)''',
+                           [(n['number'], user_id, assigned_date) for n in numbers])
+        
+            db.execute('''UPDATE countries SET used_numbers = used_numbers + ? 
+                          WHERE code = ?''', (len(numbers), country_code))
+            db.execute('''INSERT OR IGNORE INTO user_stats (user_id, date) VALUES (?, ?)''', (user_id, today))
+            db.execute('''UPDATE user_stats SET numbers_taken = numbers_taken + ? 
+                          WHERE user_id = ? AND date = ?''', (len(numbers), user_id, today))
+        
+        availability.adjust(country_code, -len(numbers))
+    return numbers, current_count
+
 def process_get_numbers(call, country_code):
     try:
         user_id = call.from_user.id
@@ -1376,44 +2247,22 @@ def process_get_numbers(call, country_code):
                                          FROM number_assignments 
                                          WHERE user_id = ? AND is_active = 1''', (user_id,))
         current_count = current_active['count'] if current_active else 0
-        max_numbers = get_setting('max_user_numbers') or 50
+        max_numbers = settings.max_user_numbers
         
         if current_count >= max_numbers:
             bot.answer_callback_query(call.id, f"❌ You can have maximum {max_numbers} active numbers. Please wait until some expire.")
             return
         
-        batch_size = get_setting('batch_size') or 1
-        remaining = max_numbers - current_count
-        if batch_size > remaining:
-            batch_size = remaining
+        batch_size = settings.batch_size
         
-        numbers = db.fetchall('''SELECT number, country, country_flag 
-                                 FROM numbers 
-                                 WHERE country_code = ? AND is_used = 0 
-                                 AND NOT EXISTS (
-                                     SELECT 1 FROM number_assignments na 
-                                     WHERE na.number = numbers.number AND na.is_active = 1
-                                 )
-                                 LIMIT ?''', (country_code, batch_size))
-        
-        if not numbers:
-            bot.answer_callback_query(call.id, "❌ No numbers available for this country!")
-            return
+        assigned_numbers, current_count = claim_numbers(user_id, country_code, batch_size, max_numbers)
         
-        assigned_numbers = []
-        for num in numbers:
-            assigned_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            db.execute('''UPDATE numbers SET is_used = 1, used_by = ?, use_date = ? 
-                          WHERE number = ?''', (user_id, assigned_date, num['number']))
-            
-            db.execute('''INSERT OR IGNORE INTO number_assignments (number, user_id, assigned_date)
-                          VALUES (?, ?, ?)''', (num['number'], user_id, assigned_date))
-            
-            assigned_numbers.append(num)
+        if current_count >= max_numbers:
+            bot.answer_callback_query(call.id, f"❌ You can have maximum {max_numbers} active numbers. Please wait until some expire.")
+            return
         
         if not assigned_numbers:
-            bot.answer_callback_query(call.id, "❌ Could not assign numbers. Please try again.")
+            bot.answer_callback_query(call.id, "❌ No numbers available for this country!")
             return
         
         msg = f"✅ Here are your {len(assigned_numbers)} number(s):\n\n"
@@ -1433,9 +2282,6 @@ def process_get_numbers(call, country_code):
         bot.edit_message_text(msg, call.message.chat.id, call.message.message_id, 
                               reply_markup=markup, parse_mode='Markdown')
         
-        db.execute('''UPDATE countries SET used_numbers = used_numbers + ? 
-                      WHERE code = ?''', (len(assigned_numbers), country_code))
-        
         country_stats = db.fetchone('''SELECT c.name, c.total_numbers, c.used_numbers FROM countries c WHERE code = ?''', (country_code,))
         if country_stats and country_stats['total_numbers'] == country_stats['used_numbers']:
             for admin_id in ADMIN_IDS:
@@ -1444,11 +2290,6 @@ def process_get_numbers(call, country_code):
                 except Exception as e:
                     logger.error(f"Error notifying admin: {e}")
         
-        today = datetime.now().strftime("%Y-%m-%d")
-        db.execute('''INSERT OR IGNORE INTO user_stats (user_id, date) VALUES (?, ?)''', (user_id, today))
-        db.execute('''UPDATE user_stats SET numbers_taken = numbers_taken + ? 
-                      WHERE user_id = ? AND date = ?''', (len(assigned_numbers), user_id, today))
-        
         bot.answer_callback_query(call.id, "✅ Numbers assigned successfully!")
     except Exception as e:
         logger.error(f"Error in process_get_numbers: {e}")
@@ -1458,7 +2299,7 @@ def process_withdraw_request(call):
     try:
         user_id = call.from_user.id
         balance = get_user_balance(user_id)
-        min_withdrawal = get_setting('min_withdrawal') or 3.0
+        min_withdrawal = settings.min_withdrawal
         
         if balance < min_withdrawal:
             bot.answer_callback_query(call.id, f"❌ Minimum withdrawal is ${min_withdrawal:.2f}")
@@ -1520,7 +2361,7 @@ def process_withdrawal_details(message):
             return
         
         balance = get_user_balance(user_id)
-        min_withdrawal = get_setting('min_withdrawal') or 3.0
+        min_withdrawal = settings.min_withdrawal
         
         if amount < min_withdrawal:
             bot.send_message(message.chat.id, f"❌ Amount must be at least ${min_withdrawal:.2f}")
@@ -1592,22 +2433,24 @@ def refresh_user_database(call):
             
             if unprocessed_otps:
                 found_new = True
+                queue_cutoff = otp_queue_cutoff()
                 for otp in unprocessed_otps:
-                    if otp['forwarded_to'] == user_id:
-                        continue
+                    if otp['queued_at'] and otp['queued_at'] >= queue_cutoff:
+                        continue  # still with the delivery queue
                     
                     try:
-                        otp_code = extract_otp_from_message(otp['message'])
+                        otp_code = extract_otp_from_message(otp['message'], otp['message_id'])
                         is_otp = otp_code is not None
                         current_balance = get_user_balance(user_id)
-                        revenue = get_setting('revenue_per_message') or 0.005
+                        revenue = settings.revenue_per_message
                         
                         formatted_msg, otp_code, flag, country = format_otp_message(
                             otp['number'], otp['message'], 
                             datetime.strptime(otp['timestamp'], "%Y-%m-%d %H:%M:%S"),
                             False,
                             current_balance,
-                            revenue if is_otp and otp['revenue_added'] == 0 else 0.0
+                            revenue if is_otp and otp['revenue_added'] == 0 else 0.0,
+                            otp['message_id']
                         )
                         
                         markup = types.InlineKeyboardMarkup()
@@ -1616,28 +2459,21 @@ def refresh_user_database(call):
                         
                         bot.send_message(user_id, formatted_msg, reply_markup=markup, parse_mode='Markdown')
                         
-                        db.execute("UPDATE otp_messages SET is_otp = ? WHERE id = ?", 
-                                  (1 if is_otp else 0, otp['id']))
+                        with db.transaction():
+                            db.execute("UPDATE otp_messages SET is_otp = ? WHERE id = ?", 
+                                      (1 if is_otp else 0, otp['id']))
                         
-                        if is_otp and otp['revenue_added'] == 0:
-                            add_revenue_to_user(user_id, revenue)
-                            increment_user_message_count(user_id, True)
-                            
-                            db.execute('''UPDATE number_assignments 
-                                          SET otp_count = otp_count + 1, 
-                                              total_revenue = total_revenue + ?
-                                          WHERE number = ? AND user_id = ?''',
-                                       (revenue, number, user_id))
-                            
-                            db.execute("UPDATE otp_messages SET revenue_added = 1 WHERE id = ?", (otp['id'],))
-                        else:
-                            increment_user_message_count(user_id, False)
+                            if (is_otp and otp['revenue_added'] == 0
+                                    and credit_otp(user_id, revenue, otp_ref(MONITORED_GROUP_ID, otp['message_id']), number, otp['timestamp'])):
+                                db.execute("UPDATE otp_messages SET revenue_added = 1 WHERE id = ?", (otp['id'],))
+                            else:
+                                increment_user_message_count(user_id, False)
                         
-                        db.execute('''UPDATE otp_messages 
-                                      SET forwarded_to = ?, processed = 1 
-                                      WHERE id = ?''', (user_id, otp['id']))
+                            db.execute('''UPDATE otp_messages 
+                                          SET forwarded_to = ?, processed = 1 
+                                          WHERE id = ?''', (user_id, otp['id']))
                         
-                        db.execute("DELETE FROM otp_messages WHERE id = ?", (otp['id'],))
+                            db.execute("DELETE FROM otp_messages WHERE id = ?", (otp['id'],))
                         
                     except Exception as e:
                         logger.error(f"Error forwarding OTP: {e}")
@@ -1672,16 +2508,28 @@ def approve_withdrawal(call, withdraw_id):
         
         process_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        update_user_balance(withdrawal['user_id'], -withdrawal['amount'])
-        
-        db.execute('''UPDATE withdrawals SET status = 'approved', 
-                      process_date = ?, admin_id = ?
-                      WHERE id = ?''',
-                   (process_date, call.from_user.id, withdraw_id))
+        # the status check and the debit are repeated inside the transaction, so two
+        # admins approving at once cannot both debit the user
+        try:
+            with db.transaction():
+                claimed = db.execute('''UPDATE withdrawals SET status = 'approved', 
+                                        process_date = ?, admin_id = ?
+                                        WHERE id = ? AND status = 'pending' ''',
+                                     (process_date, call.from_user.id, withdraw_id)).rowcount
+                if claimed:
+                    if update_user_balance(withdrawal['user_id'], -withdrawal['amount'], 'withdrawal',
+                                           f"withdrawal:{withdraw_id}", require_funds=True) is None:
+                        raise ValueError("insufficient balance")  # rolls back the status change
+                    db.execute('''UPDATE users SET total_withdrawn = total_withdrawn + ? 
+                                  WHERE user_id = ?''',
+                               (withdrawal['amount'], withdrawal['user_id']))
+        except ValueError:
+            bot.answer_callback_query(call.id, "❌ User doesn't have enough balance!")
+            return
         
-        db.execute('''UPDATE users SET total_withdrawn = total_withdrawn + ? 
-                      WHERE user_id = ?''',
-                   (withdrawal['amount'], withdrawal['user_id']))
+        if not claimed:
+            bot.answer_callback_query(call.id, "❌ Already processed!")
+            return
         
         user_msg = f"""✅ Withdrawal Approved!
 
@@ -1792,24 +2640,30 @@ def show_admin_panel(chat_id):
         logger.error(f"Error in show_admin_panel: {e}")
         bot.send_message(chat_id, "❌ Error loading admin panel")
 
-def show_admin_status(chat_id):
-    try:
-        total_users_result = db.fetchone("SELECT COUNT(*) as count FROM users WHERE is_banned = 0")
-        total_users = total_users_result['count'] if total_users_result else 0
-        
+class DashboardSnapshot:
+    """Admin status aggregates, recomputed in the background.
+    
+    refresh() runs the aggregate queries every REFRESH_INTERVAL seconds on
+    the refresher thread; show_admin_status only reads the last snapshot.
+    """
+    REFRESH_INTERVAL = 60  # seconds
+    
+    def __init__(self):
+        self._lock = Lock()
+        self._data = None
+    
+    def refresh(self):
+        started = time.time()
         yesterday = (datetime.now() - timedelta(hours=24)).strftime("%Y-%m-%d %H:%M:%S")
-        active_users_result = db.fetchone('''SELECT COUNT(DISTINCT user_id) as count FROM users 
-                                             WHERE last_activity >= ? AND is_banned = 0''', (yesterday,))
-        active_users = active_users_result['count'] if active_users_result else 0
-        
-        banned_users_result = db.fetchone("SELECT COUNT(*) as count FROM users WHERE is_banned = 1")
-        banned_users = banned_users_result['count'] if banned_users_result else 0
-        
-        total_balance_result = db.fetchone("SELECT SUM(balance) as total FROM users")
-        total_balance = total_balance_result['total'] if total_balance_result and total_balance_result['total'] else 0
+        today = datetime.now().strftime("%Y-%m-%d")
         
-        total_otps_result = db.fetchone("SELECT SUM(total_otp_received) as total FROM users")
-        total_otps = total_otps_result['total'] if total_otps_result and total_otps_result['total'] else 0
+        users = db.fetchone('''SELECT 
+                                  SUM(CASE WHEN is_banned = 0 THEN 1 ELSE 0 END) as total_users,
+                                  SUM(CASE WHEN is_banned = 0 AND last_activity >= ? THEN 1 ELSE 0 END) as active_users,
+                                  SUM(CASE WHEN is_banned = 1 THEN 1 ELSE 0 END) as banned_users,
+                                  COALESCE(SUM(balance), 0) as total_balance,
+                                  COALESCE(SUM(total_otp_received), 0) as total_otps
+                               FROM users''', (yesterday,)) or {}
         
         country_stats = db.fetchall('''SELECT c.name, c.flag, 
                                         COALESCE(COUNT(n.id), 0) as total_numbers,
@@ -1819,52 +2673,109 @@ def show_admin_status(chat_id):
                                         GROUP BY c.code, c.name, c.flag
                                         ORDER BY c.name''')
         
-        today = datetime.now().strftime("%Y-%m-%d")
         today_stats = db.fetchone('''SELECT 
                                         COALESCE(SUM(numbers_taken), 0) as taken,
                                         COALESCE(SUM(messages_received), 0) as messages,
                                         COALESCE(SUM(revenue_earned), 0) as revenue
-                                    FROM user_stats WHERE date = ?''', (today,))
+                                    FROM user_stats WHERE date = ?''', (today,)) or {}
         
         active_assignments = db.fetchone("SELECT COUNT(*) as count FROM number_assignments WHERE is_active = 1")
-        active_assignment_count = active_assignments['count'] if active_assignments else 0
         
-        pending_withdrawals = db.fetchone('''SELECT COUNT(*) as count, SUM(amount) as total 
-                                             FROM withdrawals WHERE status = 'pending' ''')
+        pending_withdrawals = db.fetchone('''SELECT COUNT(*) as count, COALESCE(SUM(amount), 0) as total 
+                                             FROM withdrawals WHERE status = 'pending' ''') or {}
         
         otp_stats = db.fetchone('''SELECT 
                                     COUNT(*) as total_messages,
-                                    SUM(CASE WHEN is_otp = 1 THEN 1 ELSE 0 END) as total_otps
-                                   FROM otp_messages WHERE processed = 1''')
+                                    COALESCE(SUM(CASE WHEN is_otp = 1 THEN 1 ELSE 0 END), 0) as total_otps
+                                   FROM otp_messages WHERE processed = 1''') or {}
+        
+        data = {
+            'total_users': users.get('total_users') or 0,
+            'active_users': users.get('active_users') or 0,
+            'banned_users': users.get('banned_users') or 0,
+            'total_balance': users.get('total_balance') or 0,
+            'total_otps': users.get('total_otps') or 0,
+            'country_stats': country_stats,
+            'today_taken': today_stats.get('taken') or 0,
+            'today_messages': today_stats.get('messages') or 0,
+            'today_revenue': today_stats.get('revenue') or 0,
+            'active_assignments': active_assignments['count'] if active_assignments else 0,
+            'pending_withdrawals': pending_withdrawals.get('count') or 0,
+            'pending_amount': pending_withdrawals.get('total') or 0,
+            'processed_messages': otp_stats.get('total_messages') or 0,
+            'processed_otps': otp_stats.get('total_otps') or 0,
+            'taken_at': datetime.now(),
+            'build_seconds': time.time() - started,
+        }
+        with self._lock:
+            self._data = data
+        return data
+    
+    def get(self):
+        """Latest snapshot; built on the caller's thread only if none exists yet."""
+        with self._lock:
+            data = self._data
+        return data if data is not None else self.refresh()
+
+dashboard = DashboardSnapshot()
+
+def start_dashboard_refresher():
+    while True:
+        try:
+            dashboard.refresh()
+        except Exception as e:
+            logger.error(f"Dashboard refresh error: {e}")
+        time.sleep(DashboardSnapshot.REFRESH_INTERVAL)
+
+def show_admin_status(chat_id):
+    try:
+        snap = dashboard.get()
+        age = int((datetime.now() - snap['taken_at']).total_seconds())
         
-        msg = f"""📊 Bot Status Report - {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        lock_stats = db.lock_wait_stats()
+        delivery_stats = delivery.stats()
+        p95 = delivery.latency.percentile(95)
+        otp_p95 = otp_latency.percentile(95)
+        
+        msg = f"""📊 Bot Status Report - {snap['taken_at'].strftime("%Y-%m-%d %H:%M:%S")}
+🕒 Snapshot age: {age}s (refreshed every {DashboardSnapshot.REFRESH_INTERVAL}s)
 
 👥 User Statistics:
-• Total Users: {total_users}
-• Active Users (24h): {active_users}
-• Banned Users: {banned_users}
-• Total Balance in System: ${total_balance:.3f}
-• Total OTPs Received: {total_otps}
-• Active Assignments: {active_assignment_count}
+• Total Users: {snap['total_users']}
+• Active Users (24h): {snap['active_users']}
+• Banned Users: {snap['banned_users']}
+• Total Balance in System: ${snap['total_balance']:.3f}
+• Total OTPs Received: {snap['total_otps']}
+• Active Assignments: {snap['active_assignments']}
 
 📈 Today's Activity:
-• Numbers Taken: {today_stats['taken'] if today_stats else 0}
-• OTPs Received: {today_stats['messages'] if today_stats else 0}
-• Revenue Distributed: ${today_stats['revenue'] if today_stats else 0:.3f}
+• Numbers Taken: {snap['today_taken']}
+• OTPs Received: {snap['today_messages']}
+• Revenue Distributed: ${snap['today_revenue']:.3f}
 
 💰 Withdrawals:
-• Pending: {pending_withdrawals['count'] if pending_withdrawals and pending_withdrawals['count'] else 0}
-• Total Pending Amount: ${pending_withdrawals['total'] if pending_withdrawals and pending_withdrawals['total'] else 0:.3f}
+• Pending: {snap['pending_withdrawals']}
+• Total Pending Amount: ${snap['pending_amount']:.3f}
 
 📨 Message Statistics:
-• Total Messages Processed: {otp_stats['total_messages'] if otp_stats and otp_stats['total_messages'] else 0}
-• Total OTPs Processed: {otp_stats['total_otps'] if otp_stats and otp_stats['total_otps'] else 0}
+• Total Messages Processed: {snap['processed_messages']}
+• Total OTPs Processed: {snap['processed_otps']}
+
+🗄️ Database:
+• Writer Lock Wait: avg {lock_stats['avg_wait'] * 1000:.2f} ms | max {lock_stats['max_wait'] * 1000:.2f} ms
+• Open Connections: {lock_stats['connections']}
+
+📤 Delivery Queue:
+• Sent: {delivery_stats['sent']} | Failed: {delivery_stats['failed']} | Retried: {delivery_stats['retried']}
+• Pending: {delivery_stats['pending']}
+• p95 Latency: {f"<= {p95}s" if p95 is not None else "n/a"}
+• OTP Group-to-User p95: {f"<= {otp_p95}s" if otp_p95 is not None else "n/a"}
 
 🌍 Country Statistics:
 """
         
-        if country_stats:
-            for country in country_stats:
+        if snap['country_stats']:
+            for country in snap['country_stats']:
                 total = country['total_numbers'] or 0
                 used = country['used_numbers'] or 0
                 if total > 0:
@@ -1882,12 +2793,12 @@ def show_admin_status(chat_id):
 
 def show_admin_settings(chat_id):
     try:
-        batch_size = get_setting('batch_size') or 1
-        revenue = get_setting('revenue_per_message') or 0.005
-        min_withdraw = get_setting('min_withdrawal') or 3.0
-        max_user_numbers = get_setting('max_user_numbers') or 50
-        withdrawal_enabled = get_setting('withdrawal_enabled') or 1
-        bot_enabled = get_setting('bot_enabled') or 1
+        batch_size = settings.batch_size
+        revenue = settings.revenue_per_message
+        min_withdraw = settings.min_withdrawal
+        max_user_numbers = settings.max_user_numbers
+        withdrawal_enabled = settings.withdrawal_enabled
+        bot_enabled = settings.bot_enabled
         
         msg = f"""⚙️ Bot Settings
 
@@ -1896,8 +2807,8 @@ Current Settings:
 • Revenue Per Message: ${revenue:.3f}
 • Minimum Withdrawal: ${min_withdraw:.2f}
 • Max Numbers Per User: {max_user_numbers}
-• Withdrawal: {'✅ Enabled' if withdrawal_enabled == 1 else '❌ Disabled'}
-• Bot Status: {'✅ Online' if bot_enabled == 1 else '❌ Offline'}
+• Withdrawal: {'✅ Enabled' if withdrawal_enabled else '❌ Disabled'}
+• Bot Status: {'✅ Online' if bot_enabled else '❌ Offline'}
 
 Select an option to change:"""
         
@@ -1959,6 +2870,164 @@ Type /cancel to cancel."""
     except Exception as e:
         logger.error(f"Error in start_broadcast: {e}")
 
+class BroadcastEngine:
+    """Sends a broadcast to every reachable user.
+    
+    Users are walked in user_id pages. Each page is sent by SENDERS threads
+    drawing from telegram_bucket, the process-wide limit shared with the
+    delivery queue, and 429s pause the bucket for retry_after. After each page
+    the cursor and counters are saved in the broadcasts table, so running
+    broadcasts resume after a restart. Users who blocked the bot or deleted
+    their account are flagged with users.blocked_bot and skipped afterwards.
+    """
+    SENDERS = 8
+    PAGE_SIZE = 200
+    MAX_RETRIES = 5
+    PROGRESS_INTERVAL = 5  # seconds between progress edits
+    SENDERS_BY_KIND = {'text': 'send_message', 'photo': 'send_photo',
+                       'video': 'send_video', 'document': 'send_document'}
+    
+    def __init__(self):
+        self.bucket = telegram_bucket
+        self._pool = ThreadPoolExecutor(max_workers=self.SENDERS)
+    
+    def start(self, admin_chat_id, kind, content, caption=None):
+        total = db.fetchone("SELECT COUNT(*) as count FROM users WHERE is_banned = 0 AND blocked_bot = 0")
+        total = total['count'] if total else 0
+        progress = bot.send_message(admin_chat_id, f"📤 Broadcasting to {total} users...")
+        broadcast_id = db.execute('''INSERT INTO broadcasts 
+                                     (admin_chat_id, progress_message_id, kind, content, caption, total, created_at)
+                                     VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                                  (admin_chat_id, progress.message_id, kind, content, caption, total,
+                                   datetime.now().strftime("%Y-%m-%d %H:%M:%S"))).lastrowid
+        Thread(target=self.run, args=(broadcast_id,), name=f"broadcast-{broadcast_id}", daemon=True).start()
+        return broadcast_id
+    
+    def resume(self):
+        """Restart broadcasts that were running when the bot stopped."""
+        for row in db.fetchall("SELECT id FROM broadcasts WHERE status = 'running'"):
+            logger.info(f"Resuming broadcast #{row['id']}")
+            Thread(target=self.run, args=(row['id'],), name=f"broadcast-{row['id']}", daemon=True).start()
+    
+    def _send(self, method, user_id, content, kwargs):
+        """Send to one user; returns 'sent', 'blocked' or 'failed'."""
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                getattr(bot, method)(user_id, content, **kwargs)
+                return 'sent'
+            except Exception as e:
+                code = getattr(e, 'error_code', None)
+                description = str(getattr(e, 'description', e)).lower()
+                if code == 403 or (code == 400 and 'chat not found' in description):
+                    return 'blocked'
+                delay = DeliveryQueue.retry_delay(e, attempt)
+                attempt += 1
+                if delay is None or attempt > self.MAX_RETRIES:
+                    return 'failed'
+                if code == 429:
+                    self.bucket.pause(delay)
+                else:
+                    time.sleep(delay)
+    
+    def run(self, broadcast_id):
+        try:
+            b = db.fetchone("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+            method = self.SENDERS_BY_KIND[b['kind']]
+            kwargs = {} if b['kind'] == 'text' else {'caption': b['caption']}
+            counts = {'sent': b['sent'], 'failed': b['failed'], 'blocked': b['blocked']}
+            last_user_id = b['last_user_id']
+            last_edit = 0
+            
+            while True:
+                page = [row['user_id'] for row in db.fetchall(
+                    '''SELECT user_id FROM users 
+                       WHERE is_banned = 0 AND blocked_bot = 0 AND user_id > ?
+                       ORDER BY user_id LIMIT ?''', (last_user_id, self.PAGE_SIZE))]
+                if not page:
+                    break
+                
+                results = list(self._pool.map(lambda uid: self._send(method, uid, b['content'], kwargs), page))
+                blocked = [uid for uid, result in zip(page, results) if result == 'blocked']
+                for result in results:
+                    counts[result] += 1
+                last_user_id = page[-1]
+                
+                with db.transaction():
+                    db.executemany("UPDATE users SET blocked_bot = 1 WHERE user_id = ?", [(uid,) for uid in blocked])
+                    db.execute('''UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, blocked = ?
+                                  WHERE id = ?''',
+                               (last_user_id, counts['sent'], counts['failed'], counts['blocked'], broadcast_id))
+                
+                if time.time() - last_edit >= self.PROGRESS_INTERVAL:
+                    last_edit = time.time()
+                    done = counts['sent'] + counts['failed'] + counts['blocked']
+                    try:
+                        bot.edit_message_text(f"📤 Broadcast #{broadcast_id}: {done}/{b['total']}\n\n"
+                                              f"Success: {counts['sent']}\nFailed: {counts['failed']}\n"
+                                              f"Blocked: {counts['blocked']}",
+                                              b['admin_chat_id'], b['progress_message_id'])
+                    except Exception:
+                        pass
+            
+            db.execute("UPDATE broadcasts SET status = 'done', finished_at = ? WHERE id = ?",
+                       (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), broadcast_id))
+            bot.send_message(b['admin_chat_id'],
+                             f"✅ Broadcast completed!\n\nSuccess: {counts['sent']}\nFailed: {counts['failed']}\n"
+                             f"Blocked the bot: {counts['blocked']}")
+        except Exception as e:
+            logger.error(f"Broadcast #{broadcast_id} error: {e}")
+            logger.error(traceback.format_exc())
+
+broadcaster = BroadcastEngine()
+
+class NewNumbersNotifier:
+    """Coalesces "new numbers added" announcements.
+    
+    Imports within WINDOW seconds of the first one are merged into a single
+    message per user (each country listed once), sent as one broadcast
+    through BroadcastEngine. The first importing admin gets its progress.
+    """
+    WINDOW = 60  # seconds
+    
+    def __init__(self):
+        self._lock = Lock()
+        self._countries = {}  # code -> (flag, name)
+        self._admin_chat_id = None
+        self._timer = None
+    
+    def notify(self, admin_chat_id, code, name, flag):
+        with self._lock:
+            self._countries[code] = (flag, name)
+            if self._timer is None:
+                self._admin_chat_id = admin_chat_id
+                self._timer = threading.Timer(self.WINDOW, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+    
+    def _flush(self):
+        with self._lock:
+            countries = sorted(self._countries.values(), key=lambda c: c[1])
+            admin_chat_id = self._admin_chat_id
+            self._countries = {}
+            self._timer = None
+        if not countries:
+            return
+        
+        if len(countries) == 1:
+            flag, name = countries[0]
+            text = f"🆕 New numbers added for {flag} {name}! Use '📇 Get Number' to get one."
+        else:
+            text = "🆕 New numbers added for:\n" + "\n".join(f"{flag} {name}" for flag, name in countries)
+            text += "\n\nUse '📇 Get Number' to get one."
+        try:
+            broadcaster.start(admin_chat_id, 'text', text)
+        except Exception as e:
+            logger.error(f"Error sending new numbers notification: {e}")
+
+new_numbers_notifier = NewNumbersNotifier()
+
 def process_broadcast(message):
     try:
         if message.text == '/cancel':
@@ -1966,31 +3035,19 @@ def process_broadcast(message):
             show_admin_panel(message.chat.id)
             return
         
-        users = db.fetchall("SELECT user_id FROM users WHERE is_banned = 0")
-        total = len(users)
-        
-        bot.send_message(message.chat.id, f"📤 Broadcasting to {total} users...")
-        
-        success = 0
-        failed = 0
-        
-        for user in users:
-            try:
-                if message.text:
-                    bot.send_message(user['user_id'], message.text)
-                elif message.photo:
-                    bot.send_photo(user['user_id'], message.photo[-1].file_id, caption=message.caption)
-                elif message.video:
-                    bot.send_video(user['user_id'], message.video.file_id, caption=message.caption)
-                elif message.document:
-                    bot.send_document(user['user_id'], message.document.file_id, caption=message.caption)
-                
-                success += 1
-                time.sleep(0.1)
-            except Exception as e:
-                failed += 1
+        if message.text:
+            kind, content, caption = 'text', message.text, None
+        elif message.photo:
+            kind, content, caption = 'photo', message.photo[-1].file_id, message.caption
+        elif message.video:
+            kind, content, caption = 'video', message.video.file_id, message.caption
+        elif message.document:
+            kind, content, caption = 'document', message.document.file_id, message.caption
+        else:
+            bot.send_message(message.chat.id, "❌ Unsupported message type for broadcast.")
+            return
         
-        bot.send_message(message.chat.id, f"✅ Broadcast completed!\n\nSuccess: {success}\nFailed: {failed}")
+        broadcaster.start(message.chat.id, kind, content, caption)
         show_admin_panel(message.chat.id)
     except Exception as e:
         logger.error(f"Error in process_broadcast: {e}")
@@ -2080,10 +3137,12 @@ def delete_country(chat_id, country_code):
             bot.send_message(chat_id, "❌ Country not found!")
             return
         
-        db.execute("DELETE FROM numbers WHERE country_code = ?", (country_code,))
-        db.execute('''DELETE FROM number_assignments WHERE number IN 
-                      (SELECT number FROM numbers WHERE country_code = ?)''', (country_code,))
-        db.execute("DELETE FROM countries WHERE code = ?", (country_code,))
+        with db.transaction():
+            db.execute('''DELETE FROM number_assignments WHERE number IN 
+                          (SELECT number FROM numbers WHERE country_code = ?)''', (country_code,))
+            db.execute("DELETE FROM numbers WHERE country_code = ?", (country_code,))
+            db.execute("DELETE FROM countries WHERE code = ?", (country_code,))
+        availability.remove(country_code)
         
         bot.send_message(chat_id, f"✅ {country['flag']} {country['name']} and all its numbers have been permanently deleted.")
     except Exception as e:
@@ -2146,34 +3205,18 @@ def process_number_file_upload(message):
         bot.reply_to(message, "📥 Downloading and processing file...")
         
         file_info = bot.get_file(message.document.file_id)
-        downloaded_file = bot.download_file(file_info.file_path)
-        
         filename = message.document.file_name.lower()
         
-        if filename.endswith('.csv'):
-            numbers = parse_csv_file(downloaded_file)
-        elif filename.endswith('.txt'):
-            numbers = parse_txt_file(downloaded_file)
-        elif filename.endswith('.json'):
-            numbers = parse_json_file(downloaded_file)
-        else:
-            numbers = parse_txt_file(downloaded_file)
-        
-        if not numbers:
-            bot.reply_to(message, "❌ No valid phone numbers found in the file.")
-            return
-        
-        cleaned_numbers = []
-        for number in numbers:
-            cleaned = re.sub(r'[^\d+]', '', number)
-            if cleaned and not cleaned.startswith('+'):
-                if len(cleaned) >= 10:
-                    cleaned = '+' + cleaned
-            if cleaned and len(cleaned) >= 10:
-                cleaned_numbers.append(cleaned)
+        stats = {'lines': 0}
+        started = time.time()
+        cleaned_numbers = list(dict.fromkeys(
+            iter_file_numbers(filename, iter_download_chunks(file_info.file_path), stats)))
+        elapsed = max(time.time() - started, 1e-6)
+        logger.info(f"Parsed {len(cleaned_numbers)} numbers from {filename}: "
+                    f"{stats['lines']} lines in {elapsed:.2f}s ({stats['lines'] / elapsed:.0f} lines/sec)")
         
         if not cleaned_numbers:
-            bot.reply_to(message, "❌ No valid phone numbers found after cleaning.")
+            bot.reply_to(message, "❌ No valid phone numbers found in the file.")
             return
         
         if message.chat.id in message_cache:
@@ -2196,86 +3239,149 @@ def process_number_file_upload(message):
         logger.error(f"Error in process_number_file_upload: {e}")
         bot.reply_to(message, f"❌ Error: {str(e)}")
 
+# Streaming number file parsing
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# 10-15 digits; spaces, dashes, dots and brackets may group them, tabs and newlines end a number
+PHONE_PATTERN = re.compile(r'(?<![\w+])\+?\(?\d(?:[ \-.()]{0,2}\d){9,14}(?!\d)')
+PHONE_HEADER_PATTERN = re.compile(r'phone|number|mobile|msisdn|tel', re.IGNORECASE)
+JSON_MAX_PENDING = 1024 * 1024  # give up on a JSON element larger than this
+
+def iter_download_chunks(file_path):
+    """Stream a Telegram file in DOWNLOAD_CHUNK_SIZE byte chunks."""
+    # same URL and proxy telebot's own download_file would use (FILE_URL is None unless overridden)
+    url = (apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}").format(API_TOKEN, file_path)
+    with requests.get(url, stream=True, timeout=60, proxies=apihelper.proxy) as resp:
+        resp.raise_for_status()
+        for chunk in resp.iter_content(DOWNLOAD_CHUNK_SIZE):
+            if chunk:
+                yield chunk
+
+def iter_text_chunks(chunks):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+def iter_lines(text_chunks, stats=None):
+    pending = ''
+    for text in text_chunks:
+        lines = (pending + text).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            if stats is not None:
+                stats['lines'] += 1
+            yield line
+    if pending:
+        if stats is not None:
+            stats['lines'] += 1
+        yield pending
+
+def numbers_in_text(text):
+    """Yield every E.164-normalized phone number found in text."""
+    for match in PHONE_PATTERN.finditer(text):
+        number = normalize_number(match.group())
+        if number and len(number) <= 16:
+            yield number
+
+def iter_txt_numbers(lines):
+    for line in lines:
+        yield from numbers_in_text(line)
+
+def iter_csv_numbers(lines):
+    """Yield numbers from CSV rows, reading only the phone column once it is known.
+    
+    The column comes from a header cell like 'phone'/'number', or failing that
+    from the first cell that holds a number.
+    """
+    column = None
+    for i, row in enumerate(csv.reader(lines)):
+        if i == 0 and column is None:
+            for idx, cell in enumerate(row):
+                if PHONE_HEADER_PATTERN.search(cell) and not PHONE_PATTERN.search(cell):
+                    column = idx
+                    break
+            if column is not None:
+                continue
+        if column is not None and column < len(row):
+            found = list(numbers_in_text(row[column]))
+            if found:
+                yield from found
+                continue
+        for idx, cell in enumerate(row):
+            found = list(numbers_in_text(cell))
+            if found:
+                if column is None:
+                    column = idx
+                yield from found
+
+def _json_item_numbers(item):
+    if isinstance(item, dict) and 'number' in item:
+        item = item['number']
+    if isinstance(item, (str, int)):
+        yield from numbers_in_text(str(item))
+
+def iter_json_numbers(text_chunks):
+    """Yield numbers from a top-level JSON array one element at a time."""
+    decoder = json.JSONDecoder()
+    buf = ''
+    started = False
+    for text in itertools.chain(text_chunks, [None]):
+        final = text is None
+        if not final:
+            buf += text
+        while True:
+            buf = buf.lstrip()
+            if not started:
+                if not buf:
+                    break
+                if buf[0] != '[':
+                    return
+                buf = buf[1:]
+                started = True
+                continue
+            if buf.startswith(','):
+                buf = buf[1:]
+                continue
+            if not buf or buf.startswith(']'):
+                if buf:
+                    return
+                break
+            try:
+                item, end = decoder.raw_decode(buf)
+            except ValueError:
+                if final or len(buf) > JSON_MAX_PENDING:
+                    logger.error("Error parsing JSON: malformed array element")
+                    return
+                break
+            if end == len(buf) and not final and not isinstance(item, (str, dict, list)):
+                # a bare number may continue in the next chunk
+                break
+            buf = buf[end:]
+            yield from _json_item_numbers(item)
+        if final:
+            break
+
+def iter_file_numbers(filename, chunks, stats=None):
+    text_chunks = iter_text_chunks(chunks)
+    if filename.endswith('.json'):
+        return iter_json_numbers(text_chunks)
+    lines = iter_lines(text_chunks, stats)
+    if filename.endswith('.csv'):
+        return iter_csv_numbers(lines)
+    return iter_txt_numbers(lines)
+
 def parse_csv_file(content):
-    numbers = []
-    try:
-        text = content.decode('utf-8', errors='ignore')
-        potential_numbers = re.findall(r'[\+\(]?[1-9][\d\-\.\s\(\)]{8,}[\d]', text)
-        
-        for num in potential_numbers:
-            extracted = extract_number_from_text(num)
-            if extracted:
-                numbers.append(extracted)
-        
-        if not numbers:
-            digit_sequences = re.findall(r'\d{10,}', text)
-            for seq in digit_sequences:
-                numbers.append('+' + seq if len(seq) >= 10 else None)
-        
-        seen = set()
-        unique_numbers = []
-        for num in numbers:
-            if num and num not in seen:
-                seen.add(num)
-                unique_numbers.append(num)
-        
-        logger.info(f"Parsed {len(unique_numbers)} numbers from CSV")
-        return unique_numbers
-        
-    except Exception as e:
-        logger.error(f"Error parsing CSV: {e}")
-        return []
+    return list(dict.fromkeys(iter_file_numbers('.csv', [content])))
 
 def parse_txt_file(content):
-    numbers = []
-    try:
-        text = content.decode('utf-8', errors='ignore')
-        lines = text.split('\n')
-        for line in lines:
-            matches = re.findall(r'[\+\(]?[1-9][\d\-\.\s\(\)]{8,}[\d]', line)
-            for match in matches:
-                extracted = extract_number_from_text(match)
-                if extracted:
-                    numbers.append(extracted)
-        
-        if not numbers:
-            digit_sequences = re.findall(r'\b\d{10,}\b', text)
-            for seq in digit_sequences:
-                if len(seq) >= 10:
-                    numbers.append('+' + seq)
-        
-        seen = set()
-        unique_numbers = []
-        for num in numbers:
-            if num and num not in seen:
-                seen.add(num)
-                unique_numbers.append(num)
-        
-        logger.info(f"Parsed {len(unique_numbers)} numbers from TXT")
-        return unique_numbers
-        
-    except Exception as e:
-        logger.error(f"Error parsing TXT: {e}")
-        return []
+    return list(dict.fromkeys(iter_file_numbers('.txt', [content])))
 
 def parse_json_file(content):
-    numbers = []
-    try:
-        data = json.loads(content.decode('utf-8'))
-        if isinstance(data, list):
-            for item in data:
-                if isinstance(item, dict) and 'number' in item:
-                    num = extract_number_from_text(str(item['number']))
-                    if num:
-                        numbers.append(num)
-                elif isinstance(item, str):
-                    num = extract_number_from_text(item)
-                    if num:
-                        numbers.append(num)
-    except:
-        pass
-    
-    return numbers
+    return list(iter_file_numbers('.json', [content]))
 
 def process_numbers_with_skip(call):
     try:
@@ -2313,6 +3419,73 @@ def process_numbers_with_overwrite(call):
         logger.error(f"Error in process_numbers_with_overwrite: {e}")
         bot.answer_callback_query(call.id, "❌ An error occurred!")
 
+IMPORT_CHUNK_SIZE = 5000
+IMPORT_PROGRESS_INTERVAL = 3  # seconds between progress edits
+
+def normalize_number(number):
+    cleaned = re.sub(r'[^\d+]', '', str(number))
+    if cleaned and not cleaned.startswith('+'):
+        cleaned = '+' + cleaned
+    return cleaned if len(cleaned) >= 10 else None
+
+def import_numbers(numbers, country_name, country_code, country_flag, batch_name,
+                   duplicate_handling, progress=None):
+    """Bulk-load numbers into the numbers table.
+    
+    Numbers are normalized and de-duplicated in memory, then written with
+    executemany in IMPORT_CHUNK_SIZE transactions so the writer lock is only
+    held per chunk. Country lookups only run when the admin left the name or
+    flag blank, and are done chunk by chunk outside the transaction. Returns
+    (added, updated, skipped).
+    """
+    unique = [n for n in dict.fromkeys(normalize_number(n) for n in numbers) if n]
+    skipped = len(numbers) - len(unique)
+    
+    final_code = country_code if country_code else 'Unknown'
+    lookup = not (country_name and country_flag)
+    resolved = {}
+    
+    def row(number):
+        flag, name = resolved[number] if lookup else (country_flag, country_name)
+        return (country_name or name, number, final_code, country_flag or flag, batch_name)
+    
+    added = 0
+    updated = 0
+    last_report = time.time()
+    for start in range(0, len(unique), IMPORT_CHUNK_SIZE):
+        chunk = unique[start:start + IMPORT_CHUNK_SIZE]
+        if lookup:
+            # resolve this chunk before taking the writer lock
+            resolved = {n: get_country_from_number(n) for n in chunk}
+        with db.transaction():
+            existing = set()
+            for i in range(0, len(chunk), 500):
+                part = chunk[i:i + 500]
+                placeholders = ','.join('?' * len(part))
+                existing.update(r['number'] for r in db.fetchall(
+                    f"SELECT number FROM numbers WHERE number IN ({placeholders})", tuple(part)))
+            
+            new_rows = [row(n) for n in chunk if n not in existing]
+            db.executemany('''INSERT INTO numbers (country, number, country_code, country_flag, batch_name)
+                              VALUES (?, ?, ?, ?, ?)
+                              ON CONFLICT(number) DO NOTHING''', new_rows)
+            added += len(new_rows)
+            
+            if duplicate_handling == 'overwrite':
+                db.executemany('''UPDATE numbers SET country = ?, country_code = ?, country_flag = ?, batch_name = ?
+                                  WHERE number = ?''',
+                               [(c, code, f, b, n) for c, n, code, f, b in (row(n) for n in chunk if n in existing)])
+                updated += len(existing)
+            else:
+                skipped += len(existing)
+        
+        done = start + len(chunk)
+        if progress and (time.time() - last_report >= IMPORT_PROGRESS_INTERVAL or done == len(unique)):
+            progress(done, len(unique))
+            last_report = time.time()
+    
+    return added, updated, skipped
+
 def add_numbers_to_db(message, numbers, duplicate_handling):
     try:
         chat_id = message.chat.id
@@ -2331,64 +3504,37 @@ def add_numbers_to_db(message, numbers, duplicate_handling):
         
         batch_name = message_cache[chat_id]['batch_name'] if chat_id in message_cache and 'batch_name' in message_cache[chat_id] else 'Default Batch'
         
-        bot.reply_to(message, f"⏳ Processing {len(numbers)} numbers for {country_flag} {country_name}...")
-        
-        added = 0
-        skipped = 0
-        updated = 0
+        status_msg = bot.reply_to(message, f"⏳ Processing {len(numbers)} numbers for {country_flag} {country_name}...")
         
-        for number in numbers:
+        def report_progress(done, total):
             try:
-                flag, name = get_country_from_number(number)
-                
-                final_country = country_name if country_name else name
-                final_code = country_code if country_code else 'Unknown'
-                final_flag = country_flag if country_flag else flag
-                
-                existing = db.fetchone("SELECT id FROM numbers WHERE number = ?", (number,))
-                
-                if existing:
-                    if duplicate_handling == 'skip':
-                        skipped += 1
-                        continue
-                    elif duplicate_handling == 'overwrite':
-                        db.execute('''UPDATE numbers SET country = ?, country_code = ?, country_flag = ?, batch_name = ?
-                                      WHERE number = ?''',
-                                   (final_country, final_code, final_flag, batch_name, number))
-                        updated += 1
-                else:
-                    db.execute('''INSERT INTO numbers (country, number, country_code, country_flag, batch_name)
-                                  VALUES (?, ?, ?, ?, ?)''',
-                               (final_country, number, final_code, final_flag, batch_name))
-                    added += 1
-                    
+                bot.edit_message_text(f"⏳ Processing numbers for {country_flag} {country_name}... {done}/{total}",
+                                      chat_id, status_msg.message_id)
             except Exception as e:
-                logger.error(f"Error processing number {number}: {e}")
-                skipped += 1
+                logger.error(f"Could not update import progress: {e}")
         
-        country = db.fetchone("SELECT * FROM countries WHERE code = ?", (country_code,))
-        if country:
-            db.execute('''UPDATE countries SET total_numbers = total_numbers + ? 
-                          WHERE code = ?''', (added, country_code))
-        else:
-            db.execute('''INSERT INTO countries (name, code, flag, total_numbers)
-                          VALUES (?, ?, ?, ?)''',
-                       (country_name, country_code, country_flag, added))
+        added, updated, skipped = import_numbers(numbers, country_name, country_code, country_flag,
+                                                 batch_name, duplicate_handling, report_progress)
+        
+        with db.transaction():
+            country = db.fetchone("SELECT * FROM countries WHERE code = ?", (country_code,))
+            if country:
+                db.execute('''UPDATE countries SET total_numbers = total_numbers + ? 
+                              WHERE code = ?''', (added, country_code))
+            else:
+                db.execute('''INSERT INTO countries (name, code, flag, total_numbers)
+                              VALUES (?, ?, ?, ?)''',
+                           (country_name, country_code, country_flag, added))
+        
+        # the import committed in several chunks, so recount rather than adjust
+        # (overwritten numbers may also have moved between countries)
+        availability.reconcile()
         
         if chat_id in message_cache:
             del message_cache[chat_id]
         
-        users = db.fetchall("SELECT user_id FROM users WHERE is_banned = 0")
-        notified = 0
-        
-        for user in users:
-            try:
-                bot.send_message(user['user_id'], 
-                                f"🆕 New numbers added for {country_flag} {country_name}! Use '📇 Get Number' to get one.")
-                notified += 1
-                time.sleep(0.1)
-            except:
-                continue
+        if added or updated:
+            new_numbers_notifier.notify(chat_id, country_code, country_name, country_flag)
         
         result_msg = f"✅ Numbers added for {country_flag} {country_name}!\n\n"
         result_msg += f"Batch Name: {batch_name}\n"
@@ -2398,7 +3544,8 @@ def add_numbers_to_db(message, numbers, duplicate_handling):
         else:
             result_msg += f"Updated: {updated}\n"
             result_msg += f"Failed: {skipped}\n"
-        result_msg += f"Notified {notified} users."
+        if added or updated:
+            result_msg += f"Users will be notified within {NewNumbersNotifier.WINDOW}s."
         
         bot.send_message(chat_id, result_msg)
         
@@ -2740,39 +3887,165 @@ Status: ✅ Your ticket has been resolved and closed.
         logger.error(f"Error in process_ticket_reply: {e}")
         bot.send_message(message.chat.id, "❌ An error occurred.")
 
-def export_stats(chat_id):
-    try:
-        today = datetime.now().strftime("%Y-%m-%d")
-        
-        users = db.fetchall('''SELECT user_id, username, first_name, last_name, balance, 
-                                      total_earned, total_withdrawn, join_date, is_banned
-                               FROM users ORDER BY join_date DESC''')
+EXPORT_PAGE_SIZE = 1000
+
+def iter_rows(query, params=(), page_size=EXPORT_PAGE_SIZE):
+    """Stream a query's rows through one cursor, page_size rows at a time."""
+    cursor = db.query(query, params)
+    while True:
+        rows = cursor.fetchmany(page_size)
+        if not rows:
+            return
+        for row in rows:
+            yield dict(row)
+
+def open_export_file(path, compress=False):
+    """Text stream for an export file, gzip-compressed when compress is set."""
+    if compress:
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+def write_csv(output, header, rows, progress=None):
+    """Write header and rows as CSV; returns the number of rows."""
+    writer = csv.writer(output)
+    writer.writerow(header)
+    count = 0
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if progress and count % EXPORT_PAGE_SIZE == 0:
+            progress(count)
+    return count
+
+class ExportJobs:
+    """Background exports for the admin panel.
+    
+    Every export is a row in export_jobs and runs on a small worker pool, so
+    at most MAX_CONCURRENT exports hit the database at once. Submitting a
+    kind that is already queued or running for the same chat returns the
+    existing job instead of starting another. A status message is edited
+    with the row count while the job runs, and the file is sent when done.
+    """
+    MAX_CONCURRENT = 2
+    PROGRESS_INTERVAL = 5  # seconds between progress edits
+    
+    def __init__(self):
+        self._lock = Lock()
+        self._active = {}  # (kind, chat_id) -> job id
+        self._kinds = {}  # kind -> (title, file suffix, compress, build(output, progress) -> rows)
+        self._pool = ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT)
+    
+    def register(self, kind, title, suffix, build, compress=False):
+        self._kinds[kind] = (title, suffix, compress, build)
+    
+    def recover(self):
+        """Mark jobs interrupted by a restart as failed."""
+        db.execute('''UPDATE export_jobs SET status = 'failed', error = 'interrupted by restart'
+                      WHERE status IN ('queued', 'running')''')
+    
+    def submit(self, kind, chat_id):
+        """Queue an export (or reuse the running one); returns the job id."""
+        title = self._kinds[kind][0]
+        with self._lock:
+            running = self._active.get((kind, chat_id))
+            if running is None:
+                job_id = db.execute('''INSERT INTO export_jobs (kind, chat_id, status, created_at) 
+                                       VALUES (?, ?, 'queued', ?)''',
+                                    (kind, chat_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))).lastrowid
+                self._active[(kind, chat_id)] = job_id
         
-        import io
-        output = io.StringIO()
-        writer = csv.writer(output)
+        if running is not None:
+            bot.send_message(chat_id, f"⏳ {title} export #{running} is already in progress.")
+            return running
         
-        writer.writerow(['User ID', 'Username', 'First Name', 'Last Name', 'Balance', 
-                         'Total Earned', 'Total Withdrawn', 'Join Date', 'Status'])
+        try:
+            status = bot.send_message(chat_id, f"📤 {title} export #{job_id} queued. The file will be sent when it is ready.")
+            self._pool.submit(self._run, job_id, kind, chat_id, status.message_id)
+        except Exception as e:
+            # never handed to the pool: release the slot so the next request can start
+            with self._lock:
+                self._active.pop((kind, chat_id), None)
+            db.execute('''UPDATE export_jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?''',
+                       (str(e)[:500], datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job_id))
+            raise
+        return job_id
+    
+    def _run(self, job_id, kind, chat_id, status_message_id):
+        title, suffix, compress, build = self._kinds[kind]
+        fd, path = tempfile.mkstemp(prefix=f"{kind}_", suffix=suffix)
+        os.close(fd)
+        last_edit = [time.time()]
+        
+        def progress(rows):
+            if time.time() - last_edit[0] < self.PROGRESS_INTERVAL:
+                return
+            last_edit[0] = time.time()
+            try:
+                bot.edit_message_text(f"⏳ {title} export #{job_id}: {rows} rows written...",
+                                      chat_id, status_message_id)
+            except Exception:
+                pass
         
-        for user in users:
-            status = 'Active' if user['is_banned'] == 0 else 'Banned'
-            writer.writerow([
-                user['user_id'],
-                user['username'] or '',
-                user['first_name'] or '',
-                user['last_name'] or '',
-                f"{user['balance']:.3f}",
-                f"{user['total_earned'] or 0:.3f}",
-                f"{user['total_withdrawn'] or 0:.3f}",
-                user['join_date'],
-                status
-            ])
-        
-        bot.send_document(chat_id, ('users_export.csv', output.getvalue()))
-        output.close()
-        
-        bot.send_message(chat_id, "✅ Stats exported successfully!")
+        try:
+            db.execute("UPDATE export_jobs SET status = 'running' WHERE id = ?", (job_id,))
+            started = time.time()
+            with open_export_file(path, compress) as output:
+                rows = build(output, progress)
+            
+            file_name = None
+            if rows:
+                file_name = f"{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{suffix}"
+                with open(path, 'rb') as f:
+                    bot.send_document(chat_id, (file_name, f))
+            
+            db.execute('''UPDATE export_jobs SET status = 'done', rows = ?, file_name = ?, finished_at = ?
+                          WHERE id = ?''',
+                       (rows, file_name, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job_id))
+            logger.info(f"Export #{job_id} ({kind}): {rows} rows in {time.time() - started:.1f}s")
+            
+            done_msg = f"✅ {title} export #{job_id} done: {rows} rows." if rows else f"❌ {title} export #{job_id}: nothing to export."
+            try:
+                bot.edit_message_text(done_msg, chat_id, status_message_id)
+            except Exception:
+                bot.send_message(chat_id, done_msg)
+        except Exception as e:
+            logger.error(f"Export #{job_id} ({kind}) failed: {e}")
+            logger.error(traceback.format_exc())
+            db.execute('''UPDATE export_jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?''',
+                       (str(e)[:500], datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job_id))
+            bot.send_message(chat_id, f"❌ {title} export #{job_id} failed!")
+        finally:
+            with self._lock:
+                self._active.pop((kind, chat_id), None)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+export_jobs = ExportJobs()
+
+def build_users_export(output, progress):
+    users = iter_rows('''SELECT user_id, username, first_name, last_name, balance, 
+                               total_earned, total_withdrawn, join_date, is_banned
+                        FROM users ORDER BY join_date DESC''')
+    return write_csv(output,
+                     ['User ID', 'Username', 'First Name', 'Last Name', 'Balance', 
+                      'Total Earned', 'Total Withdrawn', 'Join Date', 'Status'],
+                     ([user['user_id'],
+                       user['username'] or '',
+                       user['first_name'] or '',
+                       user['last_name'] or '',
+                       f"{user['balance']:.3f}",
+                       f"{user['total_earned'] or 0:.3f}",
+                       f"{user['total_withdrawn'] or 0:.3f}",
+                       user['join_date'],
+                       'Active' if user['is_banned'] == 0 else 'Banned'] for user in users),
+                     progress)
+
+export_jobs.register('users_export', "Users", '.csv', build_users_export)
+
+def export_stats(chat_id):
+    try:
+        export_jobs.submit('users_export', chat_id)
     except Exception as e:
         logger.error(f"Error in export_stats: {e}")
         bot.send_message(chat_id, "❌ Error exporting stats")
@@ -2892,32 +4165,36 @@ def reset_all_assignments_for_country(call, country_code):
         reset_count = 0
         notified_users = set()
         
-        for assignment in assignments:
-            try:
-                db.execute("UPDATE number_assignments SET is_active = 0 WHERE number = ?", 
-                           (assignment['number'],))
-                
-                db.execute("UPDATE numbers SET is_used = 0, used_by = NULL, use_date = NULL WHERE number = ?", 
-                           (assignment['number'],))
-                
-                reset_count += 1
-                
-                if assignment['user_id'] not in notified_users:
+        with db.writer():
+            with db.transaction():
+                for assignment in assignments:
                     try:
-                        user_msg = f"📢 **Important Notice**\n\n"
-                        user_msg += f"Your number assignments for {country['flag']} {country['name']} "
-                        user_msg += "have been reset by admin.\n\n"
-                        user_msg += "You can get new numbers from the '📇 Get Number' menu."
-                        bot.send_message(assignment['user_id'], user_msg, parse_mode='Markdown')
-                        notified_users.add(assignment['user_id'])
+                        db.execute("UPDATE number_assignments SET is_active = 0 WHERE number = ?", 
+                                   (assignment['number'],))
+                    
+                        db.execute("UPDATE numbers SET is_used = 0, used_by = NULL, use_date = NULL WHERE number = ?", 
+                                   (assignment['number'],))
+                    
+                        reset_count += 1
                     except Exception as e:
-                        logger.error(f"Could not notify user {assignment['user_id']}: {e}")
-                        
-            except Exception as e:
-                logger.error(f"Error resetting number {assignment.get('number')}: {e}")
+                        logger.error(f"Error resetting number {assignment.get('number')}: {e}")
+            
+                db.execute('''UPDATE countries SET used_numbers = used_numbers - ? 
+                              WHERE code = ?''', (reset_count, country_code))
         
-        db.execute('''UPDATE countries SET used_numbers = used_numbers - ? 
-                      WHERE code = ?''', (reset_count, country_code))
+            # an exhausted country is not in the availability map, so pass what adjust needs to re-add it
+            availability.adjust(country_code, reset_count, country['name'], country['flag'])
+        
+        for user_id in {a['user_id'] for a in assignments}:
+            try:
+                user_msg = f"📢 **Important Notice**\n\n"
+                user_msg += f"Your number assignments for {country['flag']} {country['name']} "
+                user_msg += "have been reset by admin.\n\n"
+                user_msg += "You can get new numbers from the '📇 Get Number' menu."
+                bot.send_message(user_id, user_msg, parse_mode='Markdown')
+                notified_users.add(user_id)
+            except Exception as e:
+                logger.error(f"Could not notify user {user_id}: {e}")
         
         success_msg = f"✅ **Reset Complete**\n\n"
         success_msg += f"Country: {country['flag']} {country['name']}\n"
@@ -2966,27 +4243,28 @@ def reset_confirm_delete_used(call):
         
         deleted_count = 0
         
-        for num in used_numbers:
-            try:
-                db.execute("DELETE FROM numbers WHERE number = ?", (num['number'],))
-                db.execute("DELETE FROM number_assignments WHERE number = ?", (num['number'],))
-                db.execute("DELETE FROM otp_messages WHERE number = ?", (num['number'],))
-                db.execute("DELETE FROM message_tracking WHERE number = ?", (num['number'],))
+        with db.transaction():
+            for num in used_numbers:
+                try:
+                    db.execute("DELETE FROM numbers WHERE number = ?", (num['number'],))
+                    db.execute("DELETE FROM number_assignments WHERE number = ?", (num['number'],))
+                    db.execute("DELETE FROM otp_messages WHERE number = ?", (num['number'],))
+                    db.execute("DELETE FROM message_tracking WHERE number = ?", (num['number'],))
                 
-                reset_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                db.execute('''INSERT INTO reset_history (number, country_code, reset_date, reset_type)
-                              VALUES (?, ?, ?, ?)''',
-                           (num['number'], num['country_code'], reset_date, 'admin'))
+                    reset_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    db.execute('''INSERT INTO reset_history (number, country_code, reset_date, reset_type)
+                                  VALUES (?, ?, ?, ?)''',
+                               (num['number'], num['country_code'], reset_date, 'admin'))
                 
-                if num['country_code']:
-                    db.execute('''UPDATE countries 
-                                  SET total_numbers = total_numbers - 1, 
-                                      used_numbers = used_numbers - 1 
-                                  WHERE code = ?''', (num['country_code'],))
+                    if num['country_code']:
+                        db.execute('''UPDATE countries 
+                                      SET total_numbers = total_numbers - 1, 
+                                          used_numbers = used_numbers - 1 
+                                      WHERE code = ?''', (num['country_code'],))
                 
-                deleted_count += 1
-            except Exception as e:
-                logger.error(f"Error deleting number {num['number']}: {e}")
+                    deleted_count += 1
+                except Exception as e:
+                    logger.error(f"Error deleting number {num['number']}: {e}")
         
         bot.edit_message_text(f"✅ Successfully deleted {deleted_count} used numbers permanently!\n\nThese numbers will never be assigned to anyone again.",
                              call.message.chat.id, call.message.message_id)
@@ -2996,99 +4274,105 @@ def reset_confirm_delete_used(call):
         logger.error(f"Error in reset_confirm_delete_used: {e}")
         bot.answer_callback_query(call.id, "❌ Error deleting numbers!")
 
+REPORT_PAGE_SIZE = 2000
+
+def iter_report_numbers(country, page_size=REPORT_PAGE_SIZE):
+    """Yield one country's numbers with their user and active assignment, keyset-paginated by number."""
+    last_number = ''
+    while True:
+        rows = db.fetchall('''SELECT 
+                                 n.number,
+                                 n.country_flag,
+                                 n.is_used,
+                                 n.batch_name,
+                                 n.use_date,
+                                 u.username as used_by_username,
+                                 u.user_id as used_by_id,
+                                 na.otp_count,
+                                 na.total_revenue,
+                                 na.assigned_date,
+                                 na.last_otp_date
+                              FROM numbers n
+                              LEFT JOIN users u ON n.used_by = u.user_id
+                              LEFT JOIN number_assignments na ON n.number = na.number AND na.is_active = 1
+                              WHERE n.country IS ? AND n.number > ?
+                              ORDER BY n.number LIMIT ?''', (country, last_number, page_size))
+        if not rows:
+            return
+        yield from rows
+        last_number = rows[-1]['number']
+
+def write_numbers_report(output, progress=None):
+    """Write the numbers report to a text stream; returns the number of numbers written."""
+    totals = db.fetchone('''SELECT COUNT(*) as total,
+                                  COALESCE(SUM(CASE WHEN is_used = 1 THEN 1 ELSE 0 END), 0) as used
+                           FROM numbers''')
+    if not totals or not totals['total']:
+        return 0
+    otp_totals = db.fetchone('''SELECT COALESCE(SUM(na.otp_count), 0) as otps,
+                                      COALESCE(SUM(na.total_revenue), 0) as revenue
+                               FROM number_assignments na
+                               JOIN numbers n ON n.number = na.number
+                               WHERE na.is_active = 1''')
+    countries = db.fetchall("SELECT country FROM numbers GROUP BY country ORDER BY country")
+    written = 0
+    
+    output.write("=" * 80 + "\n")
+    output.write("NUMBERS REPORT\n")
+    output.write(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    output.write("=" * 80 + "\n\n")
+    
+    output.write(f"Total Numbers: {totals['total']}\n")
+    
+    for row in countries:
+        output.write(f"\n{'='*60}\n")
+        output.write(f"COUNTRY: {row['country'] or 'Unknown'}\n")
+        output.write(f"{'='*60}\n\n")
+        
+        for i, num in enumerate(iter_report_numbers(row['country']), 1):
+            output.write(f"[{i}] {num['country_flag']} {num['number']}\n")
+            output.write(f"    Status: {'✅ Used' if num['is_used'] == 1 else '🟢 Available'}\n")
+            
+            if num['is_used'] == 1:
+                output.write(f"    Used By: @{num['used_by_username'] or 'N/A'} (ID: {num['used_by_id'] or 'N/A'})\n")
+                output.write(f"    Use Date: {num['use_date'] or 'N/A'}\n")
+            
+            if num['otp_count']:
+                output.write(f"    OTPs Received: {num['otp_count']}\n")
+                output.write(f"    Revenue: ${num['total_revenue'] or 0:.3f}\n")
+                output.write(f"    Last OTP: {num['last_otp_date'] or 'N/A'}\n")
+            
+            if num['batch_name']:
+                output.write(f"    Batch: {num['batch_name']}\n")
+            
+            output.write(f"    Assigned Date: {num['assigned_date'] or 'N/A'}\n")
+            output.write("\n")
+            
+            written += 1
+            if progress and written % REPORT_PAGE_SIZE == 0:
+                progress(written)
+    
+    output.write("\n" + "="*80 + "\n")
+    output.write("SUMMARY\n")
+    output.write("="*80 + "\n\n")
+    
+    output.write(f"Total Numbers: {totals['total']}\n")
+    output.write(f"Used Numbers: {totals['used']}\n")
+    output.write(f"Available Numbers: {totals['total'] - totals['used']}\n")
+    output.write(f"Total OTPs Received: {otp_totals['otps']}\n")
+    output.write(f"Total Revenue Generated: ${otp_totals['revenue']:.3f}\n")
+    output.write(f"Report Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    return totals['total']
+
 def generate_numbers_report(chat_id):
     try:
-        bot.send_message(chat_id, "📊 Generating numbers report...")
-        
-        numbers = db.fetchall('''SELECT 
-                                    n.number,
-                                    n.country,
-                                    n.country_code,
-                                    n.country_flag,
-                                    n.is_used,
-                                    n.batch_name,
-                                    n.use_date,
-                                    u.username as used_by_username,
-                                    u.user_id as used_by_id,
-                                    na.otp_count,
-                                    na.total_revenue,
-                                    na.assigned_date,
-                                    na.last_otp_date
-                                 FROM numbers n
-                                 LEFT JOIN users u ON n.used_by = u.user_id
-                                 LEFT JOIN number_assignments na ON n.number = na.number AND na.is_active = 1
-                                 ORDER BY n.country, n.number''')
-        
-        if not numbers:
-            bot.send_message(chat_id, "❌ No numbers found in database.")
-            return
-        
-        import io
-        output = io.StringIO()
-        
-        output.write("=" * 80 + "\n")
-        output.write("NUMBERS REPORT\n")
-        output.write(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        output.write("=" * 80 + "\n\n")
-        
-        output.write(f"Total Numbers: {len(numbers)}\n")
-        
-        countries = {}
-        for num in numbers:
-            country = num['country'] or 'Unknown'
-            if country not in countries:
-                countries[country] = []
-            countries[country].append(num)
-        
-        for country, nums in countries.items():
-            output.write(f"\n{'='*60}\n")
-            output.write(f"COUNTRY: {country}\n")
-            output.write(f"{'='*60}\n\n")
-            
-            for i, num in enumerate(nums, 1):
-                output.write(f"[{i}] {num['country_flag']} {num['number']}\n")
-                output.write(f"    Status: {'✅ Used' if num['is_used'] == 1 else '🟢 Available'}\n")
-                
-                if num['is_used'] == 1:
-                    output.write(f"    Used By: @{num['used_by_username'] or 'N/A'} (ID: {num['used_by_id'] or 'N/A'})\n")
-                    output.write(f"    Use Date: {num['use_date'] or 'N/A'}\n")
-                
-                if num['otp_count']:
-                    output.write(f"    OTPs Received: {num['otp_count']}\n")
-                    output.write(f"    Revenue: ${num['total_revenue'] or 0:.3f}\n")
-                    output.write(f"    Last OTP: {num['last_otp_date'] or 'N/A'}\n")
-                
-                if num['batch_name']:
-                    output.write(f"    Batch: {num['batch_name']}\n")
-                
-                output.write(f"    Assigned Date: {num['assigned_date'] or 'N/A'}\n")
-                output.write("\n")
-        
-        output.write("\n" + "="*80 + "\n")
-        output.write("SUMMARY\n")
-        output.write("="*80 + "\n\n")
-        
-        total_used = sum(1 for n in numbers if n['is_used'] == 1)
-        total_available = len(numbers) - total_used
-        total_otps = sum(n['otp_count'] or 0 for n in numbers)
-        total_revenue = sum(n['total_revenue'] or 0 for n in numbers)
-        
-        output.write(f"Total Numbers: {len(numbers)}\n")
-        output.write(f"Used Numbers: {total_used}\n")
-        output.write(f"Available Numbers: {total_available}\n")
-        output.write(f"Total OTPs Received: {total_otps}\n")
-        output.write(f"Total Revenue Generated: ${total_revenue:.3f}\n")
-        output.write(f"Report Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        
-        filename = f"numbers_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-        bot.send_document(chat_id, (filename, output.getvalue()))
-        output.close()
-        
-        bot.send_message(chat_id, "✅ Numbers report generated successfully!")
+        export_jobs.submit('numbers_report', chat_id)
     except Exception as e:
         logger.error(f"Error in generate_numbers_report: {e}")
         bot.send_message(chat_id, "❌ Error generating report!")
 
+export_jobs.register('numbers_report', "Numbers report", '.txt.gz', write_numbers_report, compress=True)
+
 # Enhanced Group message monitoring
 @bot.message_handler(func=lambda message: message.chat.id == MONITORED_GROUP_ID)
 def handle_group_message(message):
@@ -3103,8 +4387,9 @@ def handle_group_message(message):
             return
         
         logger.info(f"Message text: {text[:200]}...")
+        received = time.time()
         
-        existing = db.fetchone("SELECT id FROM message_tracking WHERE message_id = ?", (message.message_id,))
+        existing = db.fetchone("SELECT message_id FROM message_tracking WHERE message_id = ?", (message.message_id,))
         if existing:
             logger.info(f"Message {message.message_id} already processed")
             return
@@ -3120,86 +4405,77 @@ def handle_group_message(message):
         country_flag, country_name = get_country_from_number(number)
         logger.info(f"Country info: {country_name} {country_flag}")
         
-        otp_code = extract_otp_from_message(text)
+        otp_code = extract_otp_from_message(text, message.message_id)
         is_otp = otp_code is not None
         logger.info(f"Extracted OTP: {otp_code}, Is OTP: {is_otp}")
         
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        db.execute("INSERT INTO message_tracking (message_id, number, processed_date) VALUES (?, ?, ?)",
-                   (message.message_id, number, timestamp))
-        
-        db.execute('''INSERT INTO otp_messages 
-                      (number, message, otp_code, timestamp, received_date, 
-                       country, country_flag, message_id, is_otp)
-                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                   (number, text, otp_code, timestamp, timestamp, 
-                    country_name, country_flag, message.message_id, 1 if is_otp else 0))
-        
-        logger.info(f"Stored message for number {number} with OTP: {otp_code}, Is OTP: {is_otp}")
-        
-        try:
+        with db.transaction():
             assignment = db.fetchone('''SELECT user_id FROM number_assignments 
                                         WHERE number = ? AND is_active = 1''', (number,))
+            user_id = assignment['user_id'] if assignment else 0
             
-            if assignment:
-                user_id = assignment['user_id']
-                logger.info(f"Found assignment for user {user_id}")
-                
-                current_balance = get_user_balance(user_id)
-                revenue = get_setting('revenue_per_message') or 0.005
-                
-                formatted_msg, otp_code, flag, country = format_otp_message(
-                    number, text, timestamp, False, current_balance,
-                    revenue if is_otp else 0.0
-                )
-                
-                markup = types.InlineKeyboardMarkup()
-                thanks_btn = types.InlineKeyboardButton("🌺 Thanks For Using Our Bot", callback_data="thanks")
-                markup.add(thanks_btn)
-                
-                try:
-                    bot.send_message(user_id, formatted_msg, reply_markup=markup, parse_mode='Markdown')
-                    
-                    db.execute("UPDATE otp_messages SET is_otp = ? WHERE message_id = ?", 
-                              (1 if is_otp else 0, message.message_id))
-                    
-                    if is_otp:
-                        add_revenue_to_user(user_id, revenue)
-                        increment_user_message_count(user_id, True)
-                        
-                        db.execute('''UPDATE number_assignments 
-                                      SET otp_count = otp_count + 1, 
-                                          total_revenue = total_revenue + ?,
-                                          last_otp_date = ?
-                                      WHERE number = ? AND user_id = ?''',
-                                   (revenue, timestamp, number, user_id))
-                        
-                        db.execute("UPDATE otp_messages SET revenue_added = 1 WHERE message_id = ?", (message.message_id,))
-                    else:
-                        increment_user_message_count(user_id, False)
-                    
-                    db.execute('''UPDATE otp_messages 
-                                  SET forwarded_to = ?, processed = 1 
-                                  WHERE message_id = ?''', (user_id, message.message_id))
-                    
-                    logger.info(f"Forwarded message to user {user_id}. OTP: {is_otp}")
-                    
-                    try:
-                        if MONITORED_GROUP_ID:
-                            bot.delete_message(MONITORED_GROUP_ID, message.message_id)
-                            logger.info(f"Deleted message {message.message_id} from group")
-                    except Exception as e:
-                        logger.error(f"Could not delete message from group: {e}")
-                        
-                except Exception as e:
-                    logger.error(f"Error sending to user {user_id}: {e}")
-            else:
-                logger.info(f"No active assignment found for number {number}")
+            db.execute("INSERT INTO message_tracking (message_id, number, processed_date) VALUES (?, ?, ?)",
+                       (message.message_id, number, timestamp))
+            
+            # queued_at keeps the OTP processor off this row while the delivery queue has it;
+            # forwarded_to is only set once the message is actually sent
+            db.execute('''INSERT INTO otp_messages 
+                          (number, message, otp_code, timestamp, received_date, 
+                           country, country_flag, message_id, is_otp, queued_at)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                       (number, text, otp_code, timestamp, timestamp, 
+                        country_name, country_flag, message.message_id, 1 if is_otp else 0,
+                        timestamp if user_id else None))
+        
+        logger.info(f"Stored message for number {number} with OTP: {otp_code}, Is OTP: {is_otp}")
+        
+        if not user_id:
+            logger.info(f"No active assignment found for number {number}")
+            signal_otp_processor()
+            return
+        
+        logger.info(f"Found assignment for user {user_id}")
+        
+        current_balance = get_user_balance(user_id)
+        revenue = settings.revenue_per_message
+        
+        formatted_msg, otp_code, flag, country = format_otp_message(
+            number, text, timestamp, False, current_balance,
+            revenue if is_otp else 0.0, message.message_id
+        )
+        
+        markup = types.InlineKeyboardMarkup()
+        thanks_btn = types.InlineKeyboardButton("🌺 Thanks For Using Our Bot", callback_data="thanks")
+        markup.add(thanks_btn)
+        
+        chat_id = message.chat.id
+        message_id = message.message_id
+        
+        def on_sent(_):
+            otp_latency.observe(time.time() - received)
+            with db.transaction():
+                if is_otp and credit_otp(user_id, revenue, otp_ref(chat_id, message_id), number, timestamp):
+                    db.execute("UPDATE otp_messages SET revenue_added = 1 WHERE message_id = ?", (message_id,))
+                else:
+                    increment_user_message_count(user_id, False)
                 
-        except Exception as e:
-            logger.error(f"Error in immediate processing: {e}")
-            logger.error(traceback.format_exc())
+                db.execute("UPDATE otp_messages SET forwarded_to = ?, processed = 1 WHERE message_id = ?",
+                           (user_id, message_id))
+            
+            logger.info(f"Forwarded message to user {user_id}. OTP: {is_otp}")
+            
+            if MONITORED_GROUP_ID:
+                delivery.submit(MONITORED_GROUP_ID, 'delete_message', message_id)
+        
+        def on_failed(error):
+            # hand the message back to the OTP processor
+            db.execute("UPDATE otp_messages SET queued_at = NULL WHERE message_id = ? AND processed = 0", (message_id,))
+            signal_otp_processor()
+        
+        delivery.submit(user_id, 'send_message', formatted_msg, reply_markup=markup, parse_mode='Markdown',
+                        on_sent=on_sent, on_failed=on_failed)
         
     except Exception as e:
         logger.error(f"Error processing group message: {e}")
@@ -3339,7 +4615,10 @@ def add_balance_command(message):
         target_id = int(parts[1])
         amount = float(parts[2])
         
-        new_balance = update_user_balance(target_id, amount)
+        new_balance = update_user_balance(target_id, amount, 'admin')
+        if new_balance is None:
+            bot.reply_to(message, f"❌ User {target_id} not found")
+            return
         bot.reply_to(message, f"✅ Added ${amount:.3f} to user {target_id}. New balance: ${new_balance:.3f}")
     except:
         bot.reply_to(message, "Usage: /addbalance [user_id] [amount]")
@@ -3360,7 +4639,10 @@ def remove_balance_command(message):
             bot.reply_to(message, f"❌ User only has ${current:.3f}")
             return
         
-        new_balance = update_user_balance(target_id, -amount)
+        new_balance = update_user_balance(target_id, -amount, 'admin', require_funds=True)
+        if new_balance is None:
+            bot.reply_to(message, f"❌ User only has ${get_user_balance(target_id):.3f}")
+            return
         bot.reply_to(message, f"✅ Removed ${amount:.3f} from user {target_id}. New balance: ${new_balance:.3f}")
     except:
         bot.reply_to(message, "Usage: /removebalance [user_id] [amount]")
@@ -3379,10 +4661,35 @@ def set_max_numbers_command(message):
     except:
         bot.reply_to(message, "Usage: /setmaxnumbers [number]")
 
-# Start OTP processing thread
+# The delivery queue lives in memory, so rows it held before a restart go back to the OTP processor
+db.execute("UPDATE otp_messages SET queued_at = NULL WHERE processed = 0 AND queued_at IS NOT NULL")
+
+# Start OTP processing thread; the initial signal drains rows left over from a previous run
+signal_otp_processor()
 otp_processor_thread = threading.Thread(target=start_otp_processor, daemon=True)
 otp_processor_thread.start()
 
+# Start Telegram delivery workers
+delivery.start()
+
+# Pick up broadcasts that a restart interrupted
+broadcaster.resume()
+
+# Fail export jobs that a restart interrupted
+export_jobs.recover()
+
+# Restore running Get Number suspensions
+rate_limiter.load_suspensions()
+
+# Load country availability and keep it reconciled
+availability.reconcile()
+availability_thread = threading.Thread(target=start_availability_reconciler, daemon=True)
+availability_thread.start()
+
+# Keep the admin dashboard snapshot fresh
+dashboard_thread = threading.Thread(target=start_dashboard_refresher, daemon=True)
+dashboard_thread.start()
+
 # Database cleanup function
 def cleanup_database():
     """Clean up database - remove orphaned records and fix inconsistencies"""
@@ -3391,23 +4698,24 @@ def cleanup_database():
                       WHERE is_used = 1 
                       AND number NOT IN (SELECT number FROM number_assignments WHERE is_active = 1)''')
         
-        countries = db.fetchall('''SELECT code FROM countries''')
-        for country in countries:
-            code = country['code']
+        with db.transaction():
+            countries = db.fetchall('''SELECT code FROM countries''')
+            for country in countries:
+                code = country['code']
             
-            actual_stats = db.fetchone('''SELECT 
-                                            COUNT(*) as total,
-                                            SUM(CASE WHEN is_used = 1 THEN 1 ELSE 0 END) as used
-                                          FROM numbers 
-                                          WHERE country_code = ?''', (code,))
+                actual_stats = db.fetchone('''SELECT 
+                                                COUNT(*) as total,
+                                                SUM(CASE WHEN is_used = 1 THEN 1 ELSE 0 END) as used
+                                              FROM numbers 
+                                              WHERE country_code = ?''', (code,))
             
-            if actual_stats:
-                total = actual_stats['total'] or 0
-                used = actual_stats['used'] or 0
+                if actual_stats:
+                    total = actual_stats['total'] or 0
+                    used = actual_stats['used'] or 0
                 
-                db.execute('''UPDATE countries 
-                              SET total_numbers = ?, used_numbers = ? 
-                              WHERE code = ?''', (total, used, code))
+                    db.execute('''UPDATE countries 
+                                  SET total_numbers = ?, used_numbers = ? 
+                                  WHERE code = ?''', (total, used, code))
         
         cutoff = (datetime.now() - timedelta(hours=1)).strftime("%Y-%m-%d %H:%M:%S")
         db.execute("DELETE FROM otp_messages WHERE timestamp < ?", (cutoff,))
@@ -3415,6 +4723,7 @@ def cleanup_database():
         cutoff = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
         db.execute("DELETE FROM message_tracking WHERE processed_date < ?", (cutoff,))
         
+        availability.reconcile()
         return True
     except Exception as e:
         logger.error(f"Error in cleanup_database: {e}")
@@ -3426,6 +4735,8 @@ if __name__ == "__main__":
     print("🧹 Cleaning up database...")
     cleanup_database()
     print("✅ Database cleanup completed!")
+    for query, scans in db.check_hot_query_plans():
+        logger.warning(f"Hot query falls back to a full scan ({'; '.join(scans)}): {query}")
     print(f"📊 Monitoring group: {MONITORED_GROUP_ID}")
     print(f"👑 Admins: {ADMIN_IDS}")
     print(f"📣 Withdrawal Log Channel: {WITHDRAW_LOG_CHANNEL}")
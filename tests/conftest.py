@@ -0,0 +1,27 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def mnbot5(tmp_path_factory):
+    """Import mnbot5 once, with its database created in a scratch directory.
+    
+    DB_FILE is relative and each thread opens its own connection, so the
+    scratch directory stays the working directory for the whole session.
+    """
+    for dep in ('telebot', 'phonenumbers', 'pycountry', 'requests'):
+        pytest.importorskip(dep)
+    workdir = tmp_path_factory.mktemp('mnbot5')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        yield importlib.import_module('mnbot5')
+    finally:
+        os.chdir(cwd)
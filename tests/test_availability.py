@@ -0,0 +1,31 @@
+from types import SimpleNamespace
+
+
+def _silence_bot(mnbot5, monkeypatch):
+    for method in ('send_message', 'edit_message_text', 'answer_callback_query'):
+        monkeypatch.setattr(mnbot5.bot, method, lambda *args, **kwargs: None)
+
+
+def _available(mnbot5, code):
+    return {c['code']: c['available_count'] for c in mnbot5.availability.snapshot()}.get(code)
+
+
+def test_reset_brings_exhausted_country_back(mnbot5, monkeypatch):
+    _silence_bot(mnbot5, monkeypatch)
+    db = mnbot5.db
+    db.execute("INSERT INTO countries (name, code, flag) VALUES ('Resetland', 'XR', '')")
+    db.executemany('''INSERT INTO numbers (number, country, country_code, country_flag)
+                      VALUES (?, 'Resetland', 'XR', '')''', [(f'+998{i:08d}',) for i in range(3)])
+    mnbot5.availability.reconcile()
+    
+    numbers, _ = mnbot5.claim_numbers(930001, 'XR', 3, 10)
+    assert len(numbers) == 3
+    mnbot5.availability.reconcile()
+    assert _available(mnbot5, 'XR') is None
+    
+    call = SimpleNamespace(id='1', message=SimpleNamespace(chat=SimpleNamespace(id=1), message_id=1))
+    mnbot5.reset_all_assignments_for_country(call, 'XR')
+    
+    assert _available(mnbot5, 'XR') == 3
+    mnbot5.availability.reconcile()
+    assert _available(mnbot5, 'XR') == 3
@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+
+def _user(mnbot5, user_id):
+    mnbot5.db.execute("INSERT OR REPLACE INTO users (user_id, balance) VALUES (?, 0)", (user_id,))
+    return user_id
+
+
+def _run_concurrently(count, target):
+    barrier = threading.Barrier(count)
+    errors = []
+    
+    def worker(i):
+        try:
+            barrier.wait()
+            target(i)
+        except Exception as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+
+
+def _ledger(mnbot5, user_id):
+    return mnbot5.db.fetchone('''SELECT COUNT(*) AS entries, COALESCE(SUM(amount), 0) AS total
+                                 FROM balance_ledger WHERE user_id = ?''', (user_id,))
+
+
+def test_otp_ref_is_scoped_by_chat(mnbot5):
+    assert mnbot5.otp_ref(-100, 7) != mnbot5.otp_ref(-200, 7)
+    assert mnbot5.otp_ref(-100, None) is None
+
+
+def test_same_otp_credited_once_under_concurrency(mnbot5):
+    user_id = _user(mnbot5, 910001)
+    ref = mnbot5.otp_ref(-100, 42)
+    
+    def credit(_):
+        for _ in range(10):
+            mnbot5.credit_otp(user_id, 0.005, ref, '+8801700000042', '2026-01-01 00:00:00')
+    
+    _run_concurrently(16, credit)
+    
+    ledger = _ledger(mnbot5, user_id)
+    assert ledger['entries'] == 1
+    assert mnbot5.get_user_balance(user_id) == pytest.approx(0.005)
+
+
+def test_balance_matches_ledger_under_concurrency(mnbot5):
+    user_id = _user(mnbot5, 910002)
+    
+    def credit(i):
+        for n in range(25):
+            mnbot5.credit_otp(user_id, 0.005, mnbot5.otp_ref(-100, 10000 + i * 100 + n))
+            mnbot5.update_user_balance(user_id, 0.01, reason='adjustment')
+    
+    _run_concurrently(16, credit)
+    
+    ledger = _ledger(mnbot5, user_id)
+    assert ledger['entries'] == 16 * 25 * 2
+    assert ledger['total'] == pytest.approx(16 * 25 * 0.015)
+    assert mnbot5.get_user_balance(user_id) == pytest.approx(ledger['total'])
+
+
+def test_same_message_id_in_two_chats_credits_twice(mnbot5):
+    user_id = _user(mnbot5, 910003)
+    assert mnbot5.credit_otp(user_id, 0.005, mnbot5.otp_ref(-100, 5))
+    assert mnbot5.credit_otp(user_id, 0.005, mnbot5.otp_ref(-200, 5))
+    assert not mnbot5.credit_otp(user_id, 0.005, mnbot5.otp_ref(-200, 5))
+    assert _ledger(mnbot5, user_id)['entries'] == 2
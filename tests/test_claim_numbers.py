@@ -0,0 +1,43 @@
+import threading
+
+
+def _add_country(mnbot5, code, count):
+    db = mnbot5.db
+    db.execute("INSERT INTO countries (name, code, flag) VALUES (?, ?, '')", (code, code))
+    db.executemany('''INSERT INTO numbers (number, country, country_code, country_flag)
+                      VALUES (?, ?, ?, '')''',
+                   [(f'+999{i:08d}', code, code) for i in range(count)])
+
+
+def test_concurrent_claims_never_share_a_number(mnbot5):
+    _add_country(mnbot5, 'XC', 2000)
+    barrier = threading.Barrier(50)
+    claimed = []
+    claimed_lock = threading.Lock()
+    errors = []
+    
+    def worker(user_id):
+        try:
+            barrier.wait()
+            while True:
+                numbers, _ = mnbot5.claim_numbers(user_id, 'XC', 5, 10 ** 6)
+                if not numbers:
+                    return
+                with claimed_lock:
+                    claimed.extend(n['number'] for n in numbers)
+        except Exception as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=worker, args=(920000 + i,)) for i in range(50)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    
+    assert errors == []
+    assert len(claimed) == 2000
+    assert len(set(claimed)) == len(claimed)
+    active = mnbot5.db.fetchone('''SELECT COUNT(*) AS c FROM number_assignments na
+                                   JOIN numbers n ON n.number = na.number
+                                   WHERE n.country_code = 'XC' AND na.is_active = 1''')
+    assert active['c'] == 2000
@@ -0,0 +1,42 @@
+import pytest
+
+NUMBERS = [
+    '+8801712345678', '+880123', '+22507012345', '+959123456789', '+23480312345678',
+    '+12025550123', '+447911123456', '+79161234567', '+911234567890', '+4915123456789',
+    '+880', '+8801', '+88012345678901234567890', '+9999', '+0123456789', '12345', 'garbage',
+    '+1 202 555 0123', '+880 1712-345678',
+]
+
+
+def _reference(phonenumbers, pycountry, mnbot5, number):
+    """The plain phonenumbers + pycountry lookup the resolver must agree with."""
+    try:
+        region = phonenumbers.region_code_for_number(phonenumbers.parse(number))
+        country = pycountry.countries.get(alpha_2=region) if region else None
+        if country:
+            return mnbot5.get_flag_emoji(region), country.name
+    except Exception:
+        pass
+    return mnbot5.CountryResolver.UNKNOWN
+
+
+@pytest.mark.parametrize('number', NUMBERS)
+def test_matches_full_parse(mnbot5, number):
+    import phonenumbers
+    import pycountry
+    resolver = mnbot5.CountryResolver()
+    assert resolver.resolve(number) == _reference(phonenumbers, pycountry, mnbot5, number)
+
+
+def test_single_region_code_skips_parse(mnbot5, monkeypatch):
+    import phonenumbers
+    resolver = mnbot5.CountryResolver()
+    calls = []
+    real_parse = phonenumbers.parse
+    monkeypatch.setattr(phonenumbers, 'parse', lambda *args: calls.append(args) or real_parse(*args))
+    flag, name = resolver.resolve('+8801712345678')
+    assert name != 'Unknown'
+    assert calls == []
+    # a formatted number is not "+digits", so it needs the parse
+    resolver.resolve('+880 1712-345678')
+    assert len(calls) == 1
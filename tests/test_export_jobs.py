@@ -0,0 +1,34 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+
+def test_failed_status_message_releases_the_job(mnbot5, monkeypatch):
+    jobs = mnbot5.ExportJobs()
+    done = threading.Event()
+    
+    def build(output, progress):
+        done.set()
+        return 0
+    
+    jobs.register('probe', "Probe", '.csv', build)
+    
+    def unreachable(chat_id, text, **kwargs):
+        raise RuntimeError('chat unreachable')
+    
+    monkeypatch.setattr(mnbot5.bot, 'send_message', unreachable)
+    with pytest.raises(RuntimeError):
+        jobs.submit('probe', 940001)
+    
+    failed = mnbot5.db.fetchone('''SELECT status, error FROM export_jobs
+                                   WHERE kind = 'probe' AND chat_id = 940001''')
+    assert failed == {'status': 'failed', 'error': 'chat unreachable'}
+    
+    sent = []
+    monkeypatch.setattr(mnbot5.bot, 'send_message',
+                        lambda chat_id, text, **kwargs: sent.append(text) or SimpleNamespace(message_id=1))
+    monkeypatch.setattr(mnbot5.bot, 'edit_message_text', lambda *args, **kwargs: None)
+    jobs.submit('probe', 940001)
+    assert done.wait(5)
+    assert 'already in progress' not in sent[0]
@@ -0,0 +1,20 @@
+def test_hot_queries_use_indexes(mnbot5):
+    assert mnbot5.db.check_hot_query_plans() == []
+
+
+def test_index_scan_is_not_flagged(mnbot5, monkeypatch):
+    db = mnbot5.db
+    query = "SELECT number FROM otp_messages ORDER BY number"
+    details = [row['detail'] for row in db.conn.execute(f"EXPLAIN QUERY PLAN {query}")]
+    assert any(d.startswith('SCAN') and 'INDEX' in d for d in details)
+    monkeypatch.setattr(db, 'HOT_QUERIES', [(query, ())])
+    assert db.check_hot_query_plans() == []
+
+
+def test_missing_index_is_flagged(mnbot5, monkeypatch):
+    db = mnbot5.db
+    query = "SELECT * FROM otp_messages WHERE otp_code = ?"
+    monkeypatch.setattr(db, 'HOT_QUERIES', [(query, ('x',))])
+    offenders = db.check_hot_query_plans()
+    assert len(offenders) == 1
+    assert offenders[0][1][0].startswith('SCAN otp_messages')
@@ -0,0 +1,36 @@
+import pytest
+
+SAMPLES = [
+    ("Your WhatsApp code: 123-456. Don't share this code with others", '123-456'),
+    ("<#> Your WhatsApp code 123-456\nYou can also tap on this link to verify your phone: v.whatsapp.com/123456",
+     '123-456'),
+    ("G-482913 is your Google verification code.", '482913'),
+    ("Use 558812 to verify your Microsoft account", '558812'),
+    ("Your Telegram code is 48291", '48291'),
+    ("Facebook: 73920 is your confirmation code", '73920'),
+    ("Your Amazon OTP: 118273", '118273'),
+    ("[TikTok] 481 920 is your verification code, valid for 5 minutes.", '481 920'),
+    ("Your verification code for +8801712345678 is 9021", '9021'),
+    ("Call +1 202 555 0123 for help. Your OTP is 663201", '663201'),
+    ("Your code is AB12CD", 'AB12CD'),
+    ("Welcome to our service, thanks for joining", None),
+    ("Your account balance is low, call 01712345678", None),
+]
+
+
+@pytest.mark.parametrize('text, expected', SAMPLES)
+def test_extracts_expected_code(mnbot5, text, expected):
+    assert mnbot5.extract_otp_from_message(text) == expected
+
+
+def test_keyword_code_beats_bare_digits(mnbot5):
+    code, confidence = mnbot5.otp_extractor.scan("Order 4411 shipped. Your code is 902113")
+    assert code == '902113'
+    assert confidence == mnbot5.OTPExtractor.KEYWORD_CONFIDENCE
+
+
+def test_result_is_memoized_per_message_id(mnbot5):
+    extractor = mnbot5.OTPExtractor()
+    assert extractor.extract("Your code is 123456", message_id=1) == ('123456', extractor.KEYWORD_CONFIDENCE)
+    # same message id: the first result is reused
+    assert extractor.extract("no code here", message_id=1)[0] == '123456'
@@ -0,0 +1,29 @@
+import time
+from datetime import datetime
+
+
+class FloodError(Exception):
+    error_code = 429
+    result_json = {'parameters': {'retry_after': 0.2}}
+
+
+def test_otp_send_waits_out_429_and_retries(mnbot5, monkeypatch):
+    calls = []
+    
+    def send_message(chat_id, text, **kwargs):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise FloodError('Too Many Requests')
+    
+    monkeypatch.setattr(mnbot5.bot, 'send_message', send_message)
+    paused = []
+    real_pause = mnbot5.telegram_bucket.pause
+    monkeypatch.setattr(mnbot5.telegram_bucket, 'pause', lambda seconds: paused.append(seconds) or real_pause(seconds))
+    
+    job = {'user_id': 950001, 'text': 'code 123456', 'markup': None, 'received': datetime.now()}
+    delivered = mnbot5._send_user_otps([job])
+    
+    assert delivered == [job]
+    assert paused == [0.2]
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.2